@@ -44,8 +44,9 @@ echo ""
 echo "--- Creating DynamoDB table: ${TABLE_NAME} ---"
 $AWS dynamodb create-table \
     --table-name ${TABLE_NAME} \
-    --attribute-definitions AttributeName=PK,AttributeType=S AttributeName=SK,AttributeType=S \
+    --attribute-definitions AttributeName=PK,AttributeType=S AttributeName=SK,AttributeType=S AttributeName=entity_type,AttributeType=S \
     --key-schema AttributeName=PK,KeyType=HASH AttributeName=SK,KeyType=RANGE \
+    --global-secondary-indexes 'IndexName=EntityTypeIndex,KeySchema=[{AttributeName=entity_type,KeyType=HASH},{AttributeName=PK,KeyType=RANGE}],Projection={ProjectionType=ALL}' \
     --billing-mode PAY_PER_REQUEST | jq
 
 echo ""
@@ -35,6 +35,11 @@ TEST_USER_ID="test-user-for-ingestion-123"
 declare -a PREFERENCES=("source:203" "source:349" "genre:4" "genre:6")
 
 # --- Helper Functions ---
+# Decodes a Kinesis record's Data from stdin: base64-encoded, zstd-compressed JSON
+decode_record_data() {
+    base64 --decode | zstd -dcq
+}
+
 # Sets up the prerequisite data in DynamoDB
 setup_preferences() {
     print_info "Setting up prerequisite user preferences in DynamoDB..."
@@ -43,7 +48,7 @@ setup_preferences() {
         aws --profile "${PROFILE_NAME}" --endpoint-url "${ENDPOINT_URL}" \
             dynamodb put-item \
             --table-name "${TABLE_NAME}" \
-            --item "{\"PK\": {\"S\": \"userpref:${TEST_USER_ID}\"}, \"SK\": {\"S\": \"${pref_sk}\"}}"
+            --item "{\"PK\": {\"S\": \"userpref:${TEST_USER_ID}\"}, \"SK\": {\"S\": \"${pref_sk}\"}, \"entity_type\": {\"S\": \"userpref\"}}"
     done
     print_success "✅ Setup complete."
 }
@@ -64,7 +69,7 @@ teardown_test_data() {
          # Use jq to iterate over each record found in the Kinesis stream
          echo "${KINESIS_RECORDS_JSON}" | jq -c '.Records[]' | while read -r record; do
              local decoded_payload
-             decoded_payload=$(echo "$record" | jq -r '.Data' | base64 --decode)
+             decoded_payload=$(echo "$record" | jq -r '.Data' | decode_record_data)
              local title_id source_ids genre_ids
              title_id=$(echo "$decoded_payload" | jq -r '.payload.id')
              source_ids=$(echo "$decoded_payload" | jq -r '.payload.source_ids[]')
@@ -95,7 +100,7 @@ teardown_test_data() {
      # Extract data from the first Kinesis record to build our assertions
      local first_record_data decoded_payload
      first_record_data=$(echo "${KINESIS_RECORDS_JSON}" | jq -r '.Records[0].Data')
-     decoded_payload=$(echo "${first_record_data}" | base64 --decode)
+     decoded_payload=$(echo "${first_record_data}" | decode_record_data)
 
      local title_id source_id genre_id
      title_id=$(echo "${decoded_payload}" | jq -r '.payload.id')
@@ -216,7 +221,7 @@ verify_kinesis_output() {
     first_record_data=$(echo "${KINESIS_RECORDS_JSON}" | jq -r '.Records[0].Data')
 
     local decoded_payload
-    decoded_payload=$(echo "${first_record_data}" | base64 --decode)
+    decoded_payload=$(echo "${first_record_data}" | decode_record_data)
 
     # Check that the publishing component is correct
     if echo "${decoded_payload}" | jq -e '.header.publishingComponent == "UserPrefsTitleIngestionFunction"' >/dev/null; then
@@ -0,0 +1,82 @@
+#!/bin/bash
+
+# One-off backfill of the entity_type attribute that keys the EntityTypeIndex GSI.
+# Sources, genres and user preferences are read through that index, but items written before it
+# existed have no entity_type, so they are invisible to ingestion and to GET /sources and /genres.
+# This tags every such item: source:{id} -> 'source', genre:{id} -> 'genre', and the
+# userpref:{user} preference rows (SK source:/genre:) -> 'userpref'. Safe to re-run.
+
+set -e
+set -o pipefail
+
+# --- Configuration ---
+STACK_NAME="uktv-event-streaming-app"
+PROFILE="streaming"
+REGION="eu-west-2"
+
+# --- Helper Functions ---
+log() {
+    echo "✅ $1"
+}
+
+info() {
+    echo "   - $1"
+}
+
+error() {
+    echo "❌ ERROR: $1" >&2
+    exit 1
+}
+
+# --- Main Script ---
+echo "🚀 Starting entity_type backfill..."
+
+if ! command -v jq &> /dev/null; then
+    error "jq is not installed. Please install it to run this script (e.g., 'brew install jq' or 'sudo apt-get install jq')."
+fi
+
+# Step 1: Check AWS session
+log "Step 1: Checking AWS SSO session for profile: ${PROFILE}..."
+if ! aws sts get-caller-identity --profile "${PROFILE}" > /dev/null 2>&1; then
+    echo "⚠️ AWS SSO session expired or not found. Please log in."
+    aws sso login --profile "${PROFILE}"
+    if ! aws sts get-caller-identity --profile "${PROFILE}" > /dev/null 2>&1; then
+        error "AWS login failed. Please check your configuration. Aborting."
+    fi
+fi
+log "AWS SSO session is active."
+
+# Step 2: Fetch the table name
+log "Step 2: Fetching the table name from stack '$STACK_NAME'..."
+TABLE_NAME=$(aws cloudformation describe-stacks --stack-name "$STACK_NAME" --query "Stacks[0].Outputs[?OutputKey=='ProgrammesTable'].OutputValue" --output text --profile "$PROFILE" --region "$REGION")
+if [ -z "$TABLE_NAME" ]; then
+    error "Failed to retrieve the ProgrammesTable stack output. Aborting."
+fi
+info "Table Name: $TABLE_NAME"
+
+# Step 3: Find the untagged reference data and preference items.
+# The source/genre index rows (source:{id}:genre:{id}) must stay out of the GSI, so they are excluded.
+log "Step 3: Scanning '$TABLE_NAME' for untagged items..."
+ITEMS=$(aws dynamodb scan --table-name "$TABLE_NAME" \
+    --filter-expression "attribute_not_exists(entity_type) AND ((begins_with(PK, :source) AND NOT contains(PK, :genre_part)) OR begins_with(PK, :genre) OR (begins_with(PK, :userpref) AND (begins_with(SK, :source) OR begins_with(SK, :genre))))" \
+    --projection-expression "PK, SK" \
+    --expression-attribute-values '{":source": {"S": "source:"}, ":genre": {"S": "genre:"}, ":genre_part": {"S": ":genre:"}, ":userpref": {"S": "userpref:"}}' \
+    --output json --profile "$PROFILE" --region "$REGION")
+info "Found $(echo "$ITEMS" | jq '.Items | length') items to tag."
+
+# Step 4: Tag each item. The condition stops an item deleted since the scan from being recreated.
+log "Step 4: Tagging items..."
+TAGGED_COUNT=0
+while read -r entity_type key; do
+    aws dynamodb update-item --table-name "$TABLE_NAME" \
+        --key "$key" \
+        --update-expression "SET entity_type = :entity_type" \
+        --condition-expression "attribute_exists(PK)" \
+        --expression-attribute-values '{":entity_type": {"S": "'"$entity_type"'"}}' \
+        --profile "$PROFILE" --region "$REGION" > /dev/null \
+        || info "Skipped $key (it no longer exists)."
+    TAGGED_COUNT=$((TAGGED_COUNT + 1))
+done < <(echo "$ITEMS" | jq -r '.Items[]
+    | (.PK.S | split(":")[0]) + " " + ({PK, SK} | tojson)')
+
+log "Backfill complete. Processed ${TAGGED_COUNT} items."
@@ -0,0 +1,105 @@
+#!/bin/bash
+
+# One-off backfill of the recommendation index (rec_index:{source_id}:{genre_id} -> title:{id}).
+# Title enrichment maintains these rows for titles it enriches, but titles enriched before the index
+# existed have none, so they never appear in GET /recommendations until this has been run.
+# It is safe to re-run: the rows carry no data, so rewriting an existing one only renews its expiry.
+
+set -e
+set -o pipefail
+
+# --- Configuration ---
+STACK_NAME="uktv-event-streaming-app"
+PROFILE="streaming"
+REGION="eu-west-2"
+
+# --- Prefixes, threshold and expiry (should match enrichment.py) ---
+TITLE_PREFIX="title:"
+REC_INDEX_PREFIX="rec_index:"
+RECOMMENDATION_MIN_RATING="7"
+INDEX_TTL_DAYS=30
+
+# --- Helper Functions ---
+log() {
+    echo "✅ $1"
+}
+
+info() {
+    echo "   - $1"
+}
+
+error() {
+    echo "❌ ERROR: $1" >&2
+    exit 1
+}
+
+# Writes one BatchWriteItem request, retrying any unprocessed items with exponential backoff
+batch_write() {
+    local request_items="$1"
+    local delay=1
+    for attempt in 1 2 3 4 5 6; do
+        request_items=$(aws dynamodb batch-write-item --request-items "$request_items" \
+            --query "UnprocessedItems" --output json --profile "$PROFILE" --region "$REGION")
+        if [ "$(echo "$request_items" | jq 'length')" -eq 0 ]; then
+            return 0
+        fi
+        sleep "$delay"
+        delay=$((delay * 2))
+    done
+    error "Items were still unprocessed after retries: $request_items"
+}
+
+# --- Main Script ---
+echo "🚀 Starting recommendation index backfill..."
+
+if ! command -v jq &> /dev/null; then
+    error "jq is not installed. Please install it to run this script (e.g., 'brew install jq' or 'sudo apt-get install jq')."
+fi
+
+# Step 1: Check AWS session
+log "Step 1: Checking AWS SSO session for profile: ${PROFILE}..."
+if ! aws sts get-caller-identity --profile "${PROFILE}" > /dev/null 2>&1; then
+    echo "⚠️ AWS SSO session expired or not found. Please log in."
+    aws sso login --profile "${PROFILE}"
+    if ! aws sts get-caller-identity --profile "${PROFILE}" > /dev/null 2>&1; then
+        error "AWS login failed. Please check your configuration. Aborting."
+    fi
+fi
+log "AWS SSO session is active."
+
+# Step 2: Fetch the table name
+log "Step 2: Fetching the table name from stack '$STACK_NAME'..."
+TABLE_NAME=$(aws cloudformation describe-stacks --stack-name "$STACK_NAME" --query "Stacks[0].Outputs[?OutputKey=='ProgrammesTable'].OutputValue" --output text --profile "$PROFILE" --region "$REGION")
+if [ -z "$TABLE_NAME" ]; then
+    error "Failed to retrieve the ProgrammesTable stack output. Aborting."
+fi
+info "Table Name: $TABLE_NAME"
+
+# Step 3: Find the enriched titles that qualify as recommendations
+log "Step 3: Scanning '$TABLE_NAME' for titles rated above ${RECOMMENDATION_MIN_RATING}..."
+TITLES=$(aws dynamodb scan --table-name "$TABLE_NAME" \
+    --filter-expression "begins_with(PK, :title_prefix) AND SK = :record AND #d.user_rating > :min_rating" \
+    --projection-expression "PK, #d.source_ids, #d.genre_ids" \
+    --expression-attribute-names '{"#d": "data"}' \
+    --expression-attribute-values '{":title_prefix": {"S": "'"$TITLE_PREFIX"'"}, ":record": {"S": "record"}, ":min_rating": {"N": "'"$RECOMMENDATION_MIN_RATING"'"}}' \
+    --output json --profile "$PROFILE" --region "$REGION")
+info "Found $(echo "$TITLES" | jq '.Items | length') recommended titles."
+
+# Step 4: Write one index row per source/genre combination, 25 per BatchWriteItem request
+log "Step 4: Writing recommendation index rows..."
+ROW_COUNT=0
+EXPIRES_AT=$(( $(date +%s) + INDEX_TTL_DAYS * 86400 ))
+while read -r request_items; do
+    batch_write "$request_items"
+    ROW_COUNT=$((ROW_COUNT + $(echo "$request_items" | jq '.[] | length')))
+done < <(echo "$TITLES" | jq -c --arg table "$TABLE_NAME" --arg prefix "$REC_INDEX_PREFIX" --arg ttl "$EXPIRES_AT" '
+    [.Items[]
+        | .PK.S as $pk
+        | ((.data.M.source_ids.L // []) | map(.S // .N) | unique) as $sources
+        | ((.data.M.genre_ids.L // []) | map(.S // .N) | unique) as $genres
+        | $sources[] as $source | $genres[] as $genre
+        | {PutRequest: {Item: {PK: {S: "\($prefix)\($source):\($genre)"}, SK: {S: $pk}, ttl: {N: $ttl}}}}]
+    | select(length > 0) | _nwise(25)
+    | {($table): .}')
+
+log "Backfill complete. Wrote ${ROW_COUNT} recommendation index rows."
@@ -1,10 +1,52 @@
 import boto3
-import json
+import logging
+import orjson
+import os
 import secrets
 import string
-import traceback
-import urllib.request
-import urllib.error
+import time
+import urllib3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logger
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper()) # Allow log level to be set by env var
+
+# Upper bound on concurrent per-user Cognito calls; the default stays under the Cognito admin API rate limit
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '10'))
+
+# Pre-serialized empty map for the UserPasswords response field
+EMPTY_JSON_OBJECT = '{}'
+
+# Cognito group granting admin access
+ADMIN_GROUP_NAME = 'SecurityAdmins'
+
+# Manual backoff for throttles that outlast the SDK's adaptive retries
+THROTTLE_RETRY_ATTEMPTS = 4
+
+# Password generation settings
+PASSWORD_LENGTH = 16
+PASSWORD_SYMBOLS = "!@#$%^&*"
+PASSWORD_ALPHABET = string.ascii_letters + string.digits + PASSWORD_SYMBOLS
+_SYSTEM_RANDOM = secrets.SystemRandom()
+
+# Initialize AWS clients at module scope so they are reused across warm invocations.
+# Pool must be at least as large as the worker count or threads block on checkout.
+# Adaptive retries rate-limit client-side so the fan-out backs off when Cognito throttles.
+cognito_client = boto3.client('cognito-idp', config=Config(
+    max_pool_connections=max(50, MAX_WORKERS * 2),
+    tcp_keepalive=True,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    connect_timeout=3,
+    read_timeout=10
+))
+
+secretsmanager_client = boto3.client('secretsmanager')
+
+# Pooled HTTP client for CloudFormation responses; keeps connections alive across sends
+http = urllib3.PoolManager(num_pools=2, maxsize=4, retries=urllib3.Retry(3), timeout=5.0)
 
 def mask_username(username: str) -> str:
     """Mask a username for logging, showing only first 2 and last 2 characters."""
@@ -16,103 +58,180 @@ def mask_usernames(usernames: list) -> list:
     """Mask a list of usernames for logging."""
     return [mask_username(u) for u in usernames] if usernames else []
 
+# Parsers for the UserNames/AdminUserNames properties, keyed by input type
+_LIST_PARSERS = {
+    str: lambda raw_input: [u for u in map(str.strip, raw_input.split(',')) if u],
+    list: lambda raw_input: raw_input,
+}
+
+def parse_list(raw_input):
+    """Parse a comma-separated string or list into a list of usernames."""
+    parser = _LIST_PARSERS.get(type(raw_input))
+    if parser:
+        return parser(raw_input)
+    return [raw_input] if raw_input else []
+
+def _compile_alphabet(alphabet):
+    """
+    Precompute a byte translation table mapping random bytes onto alphabet.
+    Bytes at or above the largest multiple of the alphabet size are deleted to avoid modulo bias.
+    """
+    alphabet_size = len(alphabet)
+    cutoff = 256 - (256 % alphabet_size)
+    table = bytes(ord(alphabet[b % alphabet_size]) for b in range(256))
+    rejected = bytes(range(cutoff, 256))
+    return table, rejected
+
+_PASSWORD_CHARS = _compile_alphabet(PASSWORD_ALPHABET)
+# One character is guaranteed from each of these classes
+_REQUIRED_CHAR_CLASSES = (
+    _compile_alphabet(string.ascii_uppercase),
+    _compile_alphabet(string.ascii_lowercase),
+    _compile_alphabet(string.digits),
+    _compile_alphabet(PASSWORD_SYMBOLS)
+)
+
+def _random_chars(compiled_alphabet, count):
+    """Draw count uniformly random characters using bulk os.urandom bytes and rejection sampling"""
+    table, rejected = compiled_alphabet
+    chars = b''
+    while len(chars) < count:
+        chars += os.urandom((count - len(chars)) * 2).translate(table, rejected)
+    return chars[:count].decode('ascii')
+
+def generate_passwords(count):
+    """Generate passwords that meet Cognito requirements, drawing all random characters in bulk"""
+    filler_length = PASSWORD_LENGTH - len(_REQUIRED_CHAR_CLASSES)
+    filler = _random_chars(_PASSWORD_CHARS, filler_length * count)
+    required = [_random_chars(char_class, count) for char_class in _REQUIRED_CHAR_CLASSES]
+
+    passwords = []
+    for i in range(count):
+        # One guaranteed character from each required class, shuffled into the rest
+        chars = list(filler[i * filler_length:(i + 1) * filler_length])
+        chars += [class_chars[i] for class_chars in required]
+        _SYSTEM_RANDOM.shuffle(chars)
+        passwords.append(''.join(chars))
+    return passwords
+
 def generate_password():
     """Generate a random password that meets Cognito requirements"""
-    length = 16
-    alphabet = string.ascii_letters + string.digits + "!@#$%^&*"
-    password = ''.join(secrets.choice(alphabet) for _ in range(length))
-    if not any(c.isupper() for c in password):
-        password = password[:-1] + secrets.choice(string.ascii_uppercase)
-    if not any(c.islower() for c in password):
-        password = password[:-1] + secrets.choice(string.ascii_lowercase)
-    if not any(c.isdigit() for c in password):
-        password = password[:-1] + secrets.choice(string.digits)
-    return password
-
-def send_cfn_response(event, context, status, response_data=None):
+    return generate_passwords(1)[0]
+
+def call_with_backoff(operation, check_timeout_fn=None, **kwargs):
+    """
+    Call a Cognito operation, backing off exponentially on TooManyRequestsException.
+    Stops retrying once check_timeout_fn reports the handler is out of time, so the CloudFormation response isn't delayed.
+    """
+    for attempt in range(THROTTLE_RETRY_ATTEMPTS):
+        try:
+            return operation(**kwargs)
+        except ClientError as e:
+            throttled = e.response.get('Error', {}).get('Code') == 'TooManyRequestsException'
+            if not throttled or attempt == THROTTLE_RETRY_ATTEMPTS - 1:
+                raise
+            # Each sleep is well inside the handler's timeout margin, so checking before it is enough
+            if check_timeout_fn and check_timeout_fn():
+                raise
+            time.sleep(2 ** attempt)
+
+def to_data_value(value):
+    """Serialize a value for the CloudFormation response Data map, which only holds strings."""
+    return orjson.dumps(value).decode()
+
+def build_cfn_response_base(event, context):
+    """Build the invocation-constant fields of a CloudFormation custom resource response."""
+    return {
+        'Reason': f'See CloudWatch Log Stream: {context.log_stream_name}',
+        'PhysicalResourceId': event.get('PhysicalResourceId', context.log_stream_name),
+        'StackId': event['StackId'],
+        'RequestId': event['RequestId'],
+        'LogicalResourceId': event['LogicalResourceId']
+    }
+
+def send_cfn_response(event, response_base, status, response_data=None):
     """
     Send a response to CloudFormation custom resource.
     This is a custom implementation that properly handles bytes encoding for Python 3.12.
+    response_base holds the constant envelope fields from build_cfn_response_base.
     """
     if response_data is None:
         response_data = {}
     
-    response_body = json.dumps({
-        'Status': status,
-        'Reason': f'See CloudWatch Log Stream: {context.log_stream_name}',
-        'PhysicalResourceId': event.get('PhysicalResourceId', context.log_stream_name),
-        'StackId': event['StackId'],
-        'RequestId': event['RequestId'],
-        'LogicalResourceId': event['LogicalResourceId'],
-        'Data': response_data
-    })
+    # orjson emits UTF-8 bytes directly, ready to use as the PUT body
+    response_body_bytes = orjson.dumps({**response_base, 'Status': status, 'Data': response_data})
     
     response_url = event['ResponseURL']
-    print(f"[DEBUG] Sending response to: {response_url}")
-    print(f"[DEBUG] Response status: {status}")
-    print(f"[DEBUG] Response data: {response_data}")
+    logger.debug(f"Sending response to: {response_url}")
+    logger.debug(f"Response status: {status}")
+    # Deferred formatting avoids building a string copy of the payload unless DEBUG is on
+    logger.debug("Response data: %s", response_data)
     
     try:
-        # Encode the response body as bytes for Python 3.12 compatibility
-        response_body_bytes = response_body.encode('utf-8')
-        req = urllib.request.Request(response_url, data=response_body_bytes, method='PUT')
-        req.add_header('Content-Type', '')
-        req.add_header('Content-Length', str(len(response_body_bytes)))
-        
-        with urllib.request.urlopen(req) as response:
-            print(f"[DEBUG] Response sent successfully. Status code: {response.getcode()}")
-            return True
-    except urllib.error.HTTPError as e:
-        print(f"[ERROR] HTTP error sending response: {e.code} - {e.reason}")
-        print(f"[ERROR] Response body: {e.read().decode('utf-8')}")
-        return False
+        response = http.request(
+            'PUT',
+            response_url,
+            body=response_body_bytes,
+            headers={
+                'Content-Type': '',
+                'Content-Length': str(len(response_body_bytes))
+            }
+        )
+        if response.status >= 400:
+            logger.error(f"HTTP error sending response: {response.status} - {response.reason}")
+            logger.error(f"Response body: {response.data.decode('utf-8')}")
+            return False
+        logger.debug(f"Response sent successfully. Status code: {response.status}")
+        return True
     except Exception as e:
-        print(f"[ERROR] Error sending response: {str(e)}")
-        traceback.print_exc()
+        logger.error(f"Error sending response: {str(e)}", exc_info=True)
         return False
 
+def get_group_members(cognito_client, user_pool_id, group_name):
+    """
+    Return the usernames and email addresses of users already in a Cognito group.
+    The pool uses email as the username attribute, so members are matched on both.
+    Returns an empty set if the lookup fails so every admin still gets added.
+    """
+    members = set()
+    try:
+        paginator = cognito_client.get_paginator('list_users_in_group')
+        for page in paginator.paginate(UserPoolId=user_pool_id, GroupName=group_name):
+            for user in page['Users']:
+                members.add(user['Username'])
+                members.update(
+                    attr['Value'] for attr in user.get('Attributes', []) if attr['Name'] == 'email'
+                )
+    except Exception as e:
+        logger.warning(f"Could not list members of {group_name} group: {str(e)}")
+        return set()
+    logger.debug(f"Found {len(members)} existing {group_name} member identifier(s)")
+    return members
+
 def create_or_update_users(cognito_client, user_pool_id, usernames, admin_usernames, check_timeout_fn=None):
     """
     Common function to create or update Cognito users.
+    Users are processed concurrently as each one is independent and the work is
+    dominated by Cognito round-trips.
     Returns: (user_passwords dict, warnings list, failed_users list)
     """
     user_passwords = {}
     warnings = []
     failed_users = []
     successful_users = []
-    
-    for username in usernames:
-        # Check timeout if callback provided
-        if check_timeout_fn and check_timeout_fn():
-            warnings.append("Operation incomplete due to timeout")
-            break
-        
+
+    def process_user(username, is_admin, password):
+        """Create or update a single user. Returns (password, warnings, failed)."""
+        user_warnings = []
         masked_username = mask_username(username)
-        print(f"[DEBUG] Processing user: {masked_username}")
+        logger.debug(f"Processing user: {masked_username}")
         try:
-            password = generate_password()
-            print(f"[DEBUG] Generated password for {masked_username} (length: {len(password)})")
-            
             try:
-                # Check if user exists
-                print(f"[DEBUG] Checking if user exists: {masked_username}")
-                cognito_client.admin_get_user(
-                    UserPoolId=user_pool_id,
-                    Username=username
-                )
-                print(f"[DEBUG] User exists, updating password: {masked_username}")
-                # User exists, update password
-                cognito_client.admin_set_user_password(
-                    UserPoolId=user_pool_id,
-                    Username=username,
-                    Password=password,
-                    Permanent=True
-                )
-                print(f"[DEBUG] Successfully updated password for existing user: {masked_username}")
-            except cognito_client.exceptions.UserNotFoundException:
-                # Create new user
-                print(f"[DEBUG] User does not exist, creating: {masked_username}")
-                cognito_client.admin_create_user(
+                # Try to create the user first; an existing user only needs its password reset
+                logger.debug(f"Creating user: {masked_username}")
+                call_with_backoff(
+                    cognito_client.admin_create_user,
+                    check_timeout_fn=check_timeout_fn,
                     UserPoolId=user_pool_id,
                     Username=username,
                     UserAttributes=[
@@ -121,59 +240,109 @@ def create_or_update_users(cognito_client, user_pool_id, usernames, admin_userna
                     ],
                     MessageAction='SUPPRESS'
                 )
-                print(f"[DEBUG] Successfully created user: {masked_username}")
-                cognito_client.admin_set_user_password(
-                    UserPoolId=user_pool_id,
-                    Username=username,
-                    Password=password,
-                    Permanent=True
-                )
-                print(f"[DEBUG] Successfully set password for new user: {masked_username}")
+                logger.debug(f"Successfully created user: {masked_username}")
+            except cognito_client.exceptions.UsernameExistsException:
+                logger.debug(f"User exists, updating password: {masked_username}")
+
+            cognito_client.admin_set_user_password(
+                UserPoolId=user_pool_id,
+                Username=username,
+                Password=password,
+                Permanent=True
+            )
+            logger.debug(f"Successfully set password for user: {masked_username}")
             
             # Add to admin group if needed
-            if username in admin_usernames:
-                print(f"[DEBUG] Adding {masked_username} to SecurityAdmins group")
+            if is_admin:
+                logger.debug(f"Adding {masked_username} to SecurityAdmins group")
                 try:
-                    cognito_client.admin_add_user_to_group(
+                    call_with_backoff(
+                        cognito_client.admin_add_user_to_group,
+                        check_timeout_fn=check_timeout_fn,
                         UserPoolId=user_pool_id,
                         Username=username,
-                        GroupName='SecurityAdmins'
+                        GroupName=ADMIN_GROUP_NAME
                     )
-                    print(f"[DEBUG] Successfully added {masked_username} to SecurityAdmins group")
+                    logger.debug(f"Successfully added {masked_username} to SecurityAdmins group")
                 except cognito_client.exceptions.ResourceNotFoundException as e:
                     warning_msg = f"SecurityAdmins group not found when adding {masked_username}: {str(e)}"
-                    print(f"[WARNING] {warning_msg}")
-                    warnings.append(warning_msg)
+                    logger.warning(warning_msg)
+                    user_warnings.append(warning_msg)
                 except cognito_client.exceptions.InvalidParameterException as e:
                     warning_msg = f"Invalid parameter when adding {masked_username} to group: {str(e)}"
-                    print(f"[WARNING] {warning_msg}")
-                    warnings.append(warning_msg)
+                    logger.warning(warning_msg)
+                    user_warnings.append(warning_msg)
                 except Exception as e:
                     warning_msg = f"Unexpected error adding {masked_username} to group: {str(e)}"
-                    print(f"[WARNING] {warning_msg}")
-                    warnings.append(warning_msg)
+                    logger.warning(warning_msg)
+                    user_warnings.append(warning_msg)
             
             # User processed successfully
-            user_passwords[username] = password
-            successful_users.append(username)
-            print(f"[DEBUG] Successfully processed user: {masked_username}")
+            logger.debug(f"Successfully processed user: {masked_username}")
+            return password, user_warnings, False
             
         except Exception as e:
             # Catch any error for this specific user and continue with others
             error_msg = f"Failed to create/update user {masked_username}: {str(e)}"
-            print(f"[ERROR] {error_msg}")
-            print(f"[DEBUG] Traceback for {masked_username}:")
-            traceback.print_exc()
-            warnings.append(error_msg)
-            failed_users.append(username)
-            # Continue processing other users
+            # Type and message only; full tracebacks are reserved for the handler-level error path
+            logger.error(f"{error_msg} ({type(e).__name__})")
+            user_warnings.append(error_msg)
+            return None, user_warnings, True
+
+    # Partition admins from regular users up front so workers don't re-check membership
+    # Admins already in the group are treated as regular users to skip the redundant add call
+    admin_set = frozenset(admin_usernames)
+    existing_admins = get_group_members(cognito_client, user_pool_id, ADMIN_GROUP_NAME) if admin_set else set()
+    admin_set = admin_set - existing_admins
+    regular_users = [u for u in usernames if u not in admin_set]
+    admin_users = [u for u in usernames if u in admin_set]
+    ordered_users = regular_users + admin_users
+    admin_flags = [False] * len(regular_users) + [True] * len(admin_users)
+
+    # Process in batches sized to the worker pool, checking the timeout once per batch
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for start in range(0, len(ordered_users), MAX_WORKERS):
+            # Check timeout if callback provided
+            if check_timeout_fn and check_timeout_fn():
+                warnings.append("Operation incomplete due to timeout")
+                break
+            batch = ordered_users[start:start + MAX_WORKERS]
+            batch_flags = admin_flags[start:start + MAX_WORKERS]
+            # Passwords are drawn per batch so users skipped on timeout cost no CSPRNG work
+            batch_passwords = generate_passwords(len(batch))
+            results = executor.map(process_user, batch, batch_flags, batch_passwords)
+            for username, (password, user_warnings, failed) in zip(batch, results):
+                warnings.extend(user_warnings)
+                if failed:
+                    failed_users.append(username)
+                else:
+                    user_passwords[username] = password
+                    successful_users.append(username)
     
-    print(f"[DEBUG] Summary - Successful: {len(successful_users)}, Failed: {len(failed_users)}")
-    print(f"[DEBUG] Successful users: {mask_usernames(successful_users)}")
-    print(f"[DEBUG] Failed users: {mask_usernames(failed_users)}")
+    logger.debug(f"Summary - Successful: {len(successful_users)}, Failed: {len(failed_users)}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Successful users: {mask_usernames(successful_users)}")
+        logger.debug(f"Failed users: {mask_usernames(failed_users)}")
     
     return user_passwords, warnings, failed_users
 
+def store_passwords_secret(secret_name, user_passwords):
+    """Store the password map in Secrets Manager, creating the secret if needed. Returns the secret ARN."""
+    secret_string = to_data_value(user_passwords)
+    try:
+        response = secretsmanager_client.put_secret_value(
+            SecretId=secret_name,
+            SecretString=secret_string
+        )
+    except secretsmanager_client.exceptions.ResourceNotFoundException:
+        response = secretsmanager_client.create_secret(
+            Name=secret_name,
+            Description="Cognito user passwords",
+            SecretString=secret_string
+        )
+    logger.debug(f"Stored {len(user_passwords)} password(s) in secret: {secret_name}")
+    return response['ARN']
+
 def is_cloudformation_event(event):
     """Check if this is a CloudFormation CustomResource event"""
     return 'RequestType' in event and 'StackId' in event and 'ResponseURL' in event
@@ -187,62 +356,63 @@ def lambda_handler(event, context):
     warnings = []
     response_sent = False
     
+    # Constant CloudFormation response fields, built once and reused by every send
+    cfn_response_base = build_cfn_response_base(event, context) if is_cfn_event else None
+    
     # Get RequestType safely; default to '' if missing
     request_type = event.get('RequestType', '')
     
     # Calculate timeout threshold - send response 15 seconds before Lambda timeout
     initial_timeout = context.get_remaining_time_in_millis() / 1000
     timeout_threshold = 15  # seconds before timeout to send emergency response
+    # Absolute deadline on the monotonic clock, so checks don't call back into the runtime
+    timeout_at = time.monotonic() + initial_timeout
     
-    print(f"[DEBUG] Lambda invoked - Type: {'CloudFormation CustomResource' if is_cfn_event else 'Direct Invocation'}")
-    print(f"[DEBUG] RequestType: {request_type}")
-    print(f"[DEBUG] Initial remaining time: {initial_timeout:.2f} seconds")
-    print(f"[DEBUG] Will send emergency response if less than {timeout_threshold}s remaining")
-    print(f"[DEBUG] Event keys: {list(event.keys())}")
-    print(f"[DEBUG] Full event: {json.dumps(event, default=str)}")
+    logger.debug(f"Lambda invoked - Type: {'CloudFormation CustomResource' if is_cfn_event else 'Direct Invocation'}")
+    logger.debug(f"RequestType: {request_type}")
+    logger.debug(f"Initial remaining time: {initial_timeout:.2f} seconds")
+    logger.debug(f"Will send emergency response if less than {timeout_threshold}s remaining")
+    logger.debug("Event keys: %s", event.keys())
+    # Arguments are only formatted when DEBUG is enabled
+    logger.debug("Full event: %s", event)
 
     def check_timeout():
         """Check if we're approaching timeout and need to send response early"""
-        remaining = context.get_remaining_time_in_millis() / 1000
+        remaining = timeout_at - time.monotonic()
         if remaining < timeout_threshold:
-            print(f"[WARNING] Approaching timeout! Only {remaining:.2f}s remaining. Sending response now.")
+            logger.warning(f"Approaching timeout! Only {remaining:.2f}s remaining. Sending response now.")
             return True
         return False
 
     try:
-        # --- Initialize Cognito client ---
-        print("[DEBUG] Initializing Cognito client...")
-        cognito_client = boto3.client('cognito-idp')
-        print("[DEBUG] Cognito client initialized successfully")
-        
         # Get properties - handle both CloudFormation and direct invocation formats
         if is_cfn_event:
             props = event.get('ResourceProperties', {})
         else:
             props = event
         
-        print(f"[DEBUG] Properties keys: {list(props.keys())}")
+        logger.debug("Properties keys: %s", props.keys())
         user_pool_id = props.get('UserPoolId')
         
         if not user_pool_id:
             error_msg = "UserPoolId missing from event"
-            print(f"[ERROR] {error_msg}")
+            logger.error(error_msg)
             warnings.append(error_msg)
             if is_cfn_event:
-                response_data['Warnings'] = json.dumps(warnings)
-                send_cfn_response(event, context, 'SUCCESS', response_data)
+                response_data['Warnings'] = to_data_value(warnings)
+                send_cfn_response(event, cfn_response_base, 'SUCCESS', response_data)
             else:
                 return {
                     'statusCode': 400,
-                    'body': json.dumps({
+                    'body': orjson.dumps({
                         'error': error_msg,
                         'UserPasswords': {},
                         'Warnings': warnings
-                    })
+                    }).decode()
                 }
             return
 
-        print(f"[DEBUG] UserPoolId: {user_pool_id}")
+        logger.debug(f"UserPoolId: {user_pool_id}")
 
         # Handle both list and string inputs
         usernames_raw = props.get('UserNames', [])
@@ -256,62 +426,61 @@ def lambda_handler(event, context):
                 return [mask_username(u) if isinstance(u, str) else u for u in value]
             return value
         
-        print(f"[DEBUG] Raw usernames input: {mask_for_log(usernames_raw)} (type: {type(usernames_raw)})")
-        print(f"[DEBUG] Raw admin usernames input: {mask_for_log(admin_usernames_raw)} (type: {type(admin_usernames_raw)})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Raw usernames input: {mask_for_log(usernames_raw)} (type: {type(usernames_raw)})")
+            logger.debug(f"Raw admin usernames input: {mask_for_log(admin_usernames_raw)} (type: {type(admin_usernames_raw)})")
         
-        # Helper to parse comma-separated strings or lists
-        def parse_list(raw_input):
-            if isinstance(raw_input, str):
-                return [u.strip() for u in raw_input.split(',') if u.strip()]
-            elif isinstance(raw_input, list):
-                return raw_input
-            return [raw_input] if raw_input else []
-
-        usernames = parse_list(usernames_raw)
+        # Drop duplicates (keeping order) so no user is processed twice
+        usernames = list(dict.fromkeys(parse_list(usernames_raw)))
         admin_usernames = parse_list(admin_usernames_raw)
         
-        print(f"[DEBUG] Parsed usernames: {mask_usernames(usernames)}")
-        print(f"[DEBUG] Parsed admin usernames: {mask_usernames(admin_usernames)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Parsed usernames: {mask_usernames(usernames)}")
+            logger.debug(f"Parsed admin usernames: {mask_usernames(admin_usernames)}")
         
         # --- Handle DELETE (CloudFormation only) ---
         if is_cfn_event and request_type == 'Delete':
-            print("[DEBUG] Processing DELETE request")
-            for username in usernames:
-                if check_timeout():
-                    # Send response early to prevent timeout
-                    if warnings:
-                        response_data['Warnings'] = json.dumps(warnings)
-                    response_data['TimeoutWarning'] = "true"
-                    response_data['Incomplete'] = "true"
-                    send_cfn_response(event, context, 'SUCCESS', response_data)
-                    response_sent = True
-                    return
-                
+            logger.debug("Processing DELETE request")
+
+            def delete_user(username):
+                """Delete a single user. Returns a warning message or None."""
                 masked_username = mask_username(username)
-                print(f"[DEBUG] Attempting to delete user: {masked_username}")
+                logger.debug(f"Attempting to delete user: {masked_username}")
                 try:
                     cognito_client.admin_delete_user(
                         UserPoolId=user_pool_id,
                         Username=username
                     )
-                    print(f"[DEBUG] Successfully deleted user: {masked_username}")
+                    logger.debug(f"Successfully deleted user: {masked_username}")
                 except cognito_client.exceptions.UserNotFoundException:
-                    print(f"[DEBUG] User not found (already deleted?): {masked_username}")
+                    logger.debug(f"User not found (already deleted?): {masked_username}")
                 except Exception as e:
                     # Log error but continue so we don't fail the whole batch
                     warning_msg = f"Failed to delete user {masked_username}: {str(e)}"
-                    print(f"[WARNING] {warning_msg}")
-                    warnings.append(warning_msg)
+                    logger.warning(warning_msg)
+                    return warning_msg
+                return None
+
+            # Delete in batches sized to the worker pool, checking the timeout once per batch
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                for start in range(0, len(usernames), MAX_WORKERS):
+                    if check_timeout():
+                        # Remaining users are skipped to avoid hitting the Lambda timeout
+                        response_data['TimeoutWarning'] = "true"
+                        response_data['Incomplete'] = "true"
+                        break
+                    batch = usernames[start:start + MAX_WORKERS]
+                    warnings.extend(w for w in executor.map(delete_user, batch) if w)
             
             if warnings:
-                response_data['Warnings'] = json.dumps(warnings)
-            print("[DEBUG] Sending SUCCESS response for DELETE")
-            send_cfn_response(event, context, 'SUCCESS', response_data)
+                response_data['Warnings'] = to_data_value(warnings)
+            logger.debug("Sending SUCCESS response for DELETE")
+            send_cfn_response(event, cfn_response_base, 'SUCCESS', response_data)
             response_sent = True
             return
         
         # --- Handle CREATE / UPDATE ---
-        print("[DEBUG] Processing CREATE/UPDATE request")
+        logger.debug("Processing CREATE/UPDATE request")
         
         # Use common function for user creation
         user_passwords, creation_warnings, failed_users = create_or_update_users(
@@ -321,80 +490,92 @@ def lambda_handler(event, context):
         warnings.extend(creation_warnings)
         
         # Build response data
-        if user_passwords:
-            response_data['UserPasswords'] = json.dumps(user_passwords)
+        return_passwords = str(props.get('ReturnPasswords', 'true')).lower() != 'false'
+        if user_passwords and is_cfn_event and not return_passwords:
+            # Keep cleartext passwords out of the CloudFormation response; only the secret ARN is returned
+            response_data['UserPasswords'] = EMPTY_JSON_OBJECT
+            secret_name = props.get('PasswordsSecretName')
+            if secret_name:
+                try:
+                    response_data['UserPasswordsSecretArn'] = store_passwords_secret(secret_name, user_passwords)
+                except Exception as e:
+                    warning_msg = f"Failed to store passwords in Secrets Manager: {str(e)}"
+                    logger.warning(warning_msg)
+                    warnings.append(warning_msg)
+            else:
+                warnings.append("ReturnPasswords is false but PasswordsSecretName is missing; passwords were not stored")
+        elif user_passwords:
+            # Direct invocations return the dict in the body, so only CloudFormation needs a serialized copy
+            response_data['UserPasswords'] = to_data_value(user_passwords) if is_cfn_event else EMPTY_JSON_OBJECT
         else:
             if not warnings:
                 warnings.append("No users were successfully created")
-            response_data['UserPasswords'] = json.dumps({})
+            response_data['UserPasswords'] = EMPTY_JSON_OBJECT
         
-        response_data['Warnings'] = json.dumps(warnings)
+        response_data['Warnings'] = to_data_value(warnings)
         if warnings:
-            print(f"[WARNING] There were {len(warnings)} warnings during user creation")
+            logger.warning(f"There were {len(warnings)} warnings during user creation")
         
         if failed_users:
-            response_data['FailedUsers'] = json.dumps(failed_users)
-            print(f"[WARNING] {len(failed_users)} user(s) failed to create: {mask_usernames(failed_users)}")
+            response_data['FailedUsers'] = to_data_value(failed_users)
+            logger.warning(f"{len(failed_users)} user(s) failed to create: {mask_usernames(failed_users)}")
         
         # Return appropriate response based on invocation type
         if is_cfn_event:
             # Always return SUCCESS to allow stack to proceed, even if some users failed
-            print("[DEBUG] Sending SUCCESS response (stack will proceed despite any user creation failures)")
-            send_cfn_response(event, context, 'SUCCESS', response_data)
+            logger.debug("Sending SUCCESS response (stack will proceed despite any user creation failures)")
+            send_cfn_response(event, cfn_response_base, 'SUCCESS', response_data)
             response_sent = True
         else:
             # Direct invocation - return standard Lambda response
             return {
                 'statusCode': 200 if not failed_users else 207,  # 207 = Multi-Status (partial success)
-                'body': json.dumps({
+                'body': orjson.dumps({
                     'UserPasswords': user_passwords,
                     'Warnings': warnings,
                     'FailedUsers': failed_users if failed_users else None
-                })
+                }).decode()
             }
         
     except Exception as e:
         error_msg = f"Critical error in Lambda handler: {str(e)}"
-        print(f"[ERROR] {error_msg}")
-        print("[DEBUG] Full traceback:")
-        traceback.print_exc()
+        logger.error(error_msg, exc_info=True)
         
         warnings.append(error_msg)
         # Always ensure both UserPasswords and Warnings are set
         if 'UserPasswords' not in response_data:
-            response_data['UserPasswords'] = json.dumps({})
-        response_data['Warnings'] = json.dumps(warnings)
+            response_data['UserPasswords'] = EMPTY_JSON_OBJECT
+        response_data['Warnings'] = to_data_value(warnings)
         response_data['CriticalError'] = str(e)
         
         if is_cfn_event:
             # Always return SUCCESS to prevent stack failure
-            print("[WARNING] Returning SUCCESS despite error to allow stack deployment to proceed")
-            print("[WARNING] Check CloudWatch logs and Warnings output for details")
-            send_cfn_response(event, context, 'SUCCESS', response_data)
+            logger.warning("Returning SUCCESS despite error to allow stack deployment to proceed")
+            logger.warning("Check CloudWatch logs and Warnings output for details")
+            send_cfn_response(event, cfn_response_base, 'SUCCESS', response_data)
             response_sent = True
         else:
             # Direct invocation - return error response
             return {
                 'statusCode': 500,
-                'body': json.dumps({
+                'body': orjson.dumps({
                     'error': error_msg,
                     'UserPasswords': {},
                     'Warnings': warnings
-                })
+                }).decode()
             }
     finally:
         # Ensure response is always sent for CloudFormation events, even if something goes wrong
         if is_cfn_event and not response_sent:
-            print("[CRITICAL] Response not sent in normal flow! Sending emergency response in finally block")
+            logger.critical("Response not sent in normal flow! Sending emergency response in finally block")
             try:
                 emergency_response = response_data.copy()
                 if 'UserPasswords' not in emergency_response:
-                    emergency_response['UserPasswords'] = json.dumps({})
+                    emergency_response['UserPasswords'] = EMPTY_JSON_OBJECT
                 if 'Warnings' not in emergency_response:
-                    emergency_response['Warnings'] = json.dumps(["Lambda handler exited without sending response"])
+                    emergency_response['Warnings'] = to_data_value(["Lambda handler exited without sending response"])
                 emergency_response['EmergencyResponse'] = "true"
-                send_cfn_response(event, context, 'SUCCESS', emergency_response)
+                send_cfn_response(event, cfn_response_base, 'SUCCESS', emergency_response)
                 response_sent = True
             except Exception as final_error:
-                print(f"[CRITICAL] Failed to send emergency response: {str(final_error)}")
-                traceback.print_exc()
\ No newline at end of file
+                logger.critical(f"Failed to send emergency response: {str(final_error)}", exc_info=True)
\ No newline at end of file
@@ -1,17 +1,51 @@
-import json
 import boto3
+import heapq
+import itertools
+import logging
+import math
+import orjson
 import os
+import time
 import uuid
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
-lambda_client = boto3.client('lambda')
-cloudwatch = boto3.client('cloudwatch')
-logs_client = boto3.client('logs')
+from functools import lru_cache
+
+# Configure logger
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper()) # Allow log level to be set by env var
+
+# Shared tuned config for all AWS clients
+boto_config = Config(
+    max_pool_connections=64,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    connect_timeout=3,
+    read_timeout=10
+)
+
+@lru_cache(maxsize=None)
+def get_client(service_name):
+    """
+    Returns the AWS client for a service, created on first use and reused for the execution environment.
+    A cold start only loads the service models the requested route actually needs.
+    """
+    return boto3.client(service_name, config=boto_config)
+
+# Shared pool for overlapping independent AWS calls; boto3 clients are safe to share across threads
+executor = ThreadPoolExecutor(max_workers=16)
 
 # --- Configuration ---
 PROGRAMMES_TABLE_NAME = os.environ.get('PROGRAMMES_TABLE_NAME', 'UKTVProgrammes')
+SUMMARY_CACHE_TTL_SECONDS = 300
+# Title id lists longer than this are split into ~sqrt(N) shards, each enriched by its own invocation
+ENRICHMENT_SHARD_THRESHOLD = 25
+# Number of most recent log events returned by the logs endpoint
+LOG_EVENTS_LIMIT = 20
+# Bounds on one logs request: the default lookback, and how many FilterLogEvents pages (and events) it may read
+LOG_DEFAULT_LOOKBACK_SECONDS = 900
+LOG_PAGE_SIZE = 1000
+LOG_MAX_PAGES = 5
 
 # Lambda function ARNs from environment variables
 # Map friendly names to the environment variable that holds the ARN
@@ -23,14 +57,25 @@ LAMBDA_CONFIG = {
     "Web API": os.environ.get('WEB_API_LAMBDA_ARN')
 }
 
+# Derived once at cold start: function names for each configured ARN, and the ARNs callers may query
+_ARN_TO_NAME = {arn: arn.split(':')[-1] for arn in LAMBDA_CONFIG.values() if arn}
+_ALLOWED_ARNS = frozenset(_ARN_TO_NAME)
+
 # --- Helper Functions ---
 
+@lru_cache(maxsize=1)
+def describe_programmes_table(time_bucket):
+    """
+    Describes the programmes table, cached per time bucket so warm containers reuse the result.
+    DynamoDB only refreshes ItemCount/TableSizeBytes every ~6 hours. Errors are not cached.
+    """
+    return get_client('dynamodb').describe_table(TableName=PROGRAMMES_TABLE_NAME)['Table']
+
 def get_dynamodb_summary():
     """Retrieves summary information for DynamoDB tables."""
     summary = {"tables": []}
     try:
-        table_description = dynamodb.meta.client.describe_table(TableName=PROGRAMMES_TABLE_NAME)
-        table_info = table_description['Table']
+        table_info = describe_programmes_table(int(time.time()) // SUMMARY_CACHE_TTL_SECONDS)
         
         item_count = table_info.get('ItemCount', 0)
         table_size_bytes = table_info.get('TableSizeBytes', 0)
@@ -42,33 +87,98 @@ def get_dynamodb_summary():
         })
         summary["message"] = "DynamoDB data summary retrieved successfully."
         return summary, 200
-    except dynamodb.meta.client.exceptions.ResourceNotFoundException:
+    except get_client('dynamodb').exceptions.ResourceNotFoundException:
         return {"message": f"DynamoDB table '{PROGRAMMES_TABLE_NAME}' not found.", "tables": []}, 404
     except Exception as e:
-        print(f"Error retrieving DynamoDB summary: {str(e)}")
+        logger.error(f"Error retrieving DynamoDB summary: {str(e)}")
         return {"message": str(e), "tables": []}, 500
 
-def trigger_lambda_function(function_arn, payload=None):
-    """Triggers another Lambda function asynchronously."""
+def trigger_lambda_function(function_arn, payload=None, payload_template=None):
+    """
+    Triggers another Lambda function asynchronously.
+    A pre-encoded payload_template may be passed instead of payload; its __JOBID__ placeholder receives the job id.
+    """
     job_id = str(uuid.uuid4())
     
     if not function_arn:
         return {"message": "Lambda function ARN is not configured."}, 500
         
     try:
-        if payload is None: payload = {}
-        payload['job_id'] = job_id
+        if payload_template is not None:
+            payload_bytes = payload_template.replace(b'__JOBID__', job_id.encode())
+        else:
+            if payload is None: payload = {}
+            payload['job_id'] = job_id
+            payload_bytes = orjson.dumps(payload)
+
+        get_client('lambda').invoke(
+            FunctionName=function_arn,
+            InvocationType='Event',
+            Payload=payload_bytes
+        )
+        return {"message": f"Lambda function initiated.", "job_id": job_id}, 202
+    except Exception as e:
+        logger.error(f"Error invoking Lambda {function_arn}: {str(e)}")
+        return {"message": str(e)}, 500
+
+def trigger_enrichment(body):
+    """
+    Triggers title enrichment, fanning large 'title_ids' lists out over ~sqrt(N) asynchronous
+    invocations so the titles are enriched in parallel rather than by a single invocation.
+    """
+    function_arn = LAMBDA_CONFIG["Title Enrichment"]
+    title_ids = body.get('title_ids')
+    if not isinstance(title_ids, list) or len(title_ids) <= ENRICHMENT_SHARD_THRESHOLD:
+        return trigger_lambda_function(function_arn, payload=body)
+    if not function_arn:
+        return {"message": "Lambda function ARN is not configured."}, 500
 
+    job_id = str(uuid.uuid4())
+    shard_size = math.isqrt(len(title_ids) - 1) + 1
+    shards = [title_ids[i:i + shard_size] for i in range(0, len(title_ids), shard_size)]
+    # Create the client here rather than racing to create it from the pool threads
+    lambda_client = get_client('lambda')
+
+    def invoke_shard(shard):
         lambda_client.invoke(
             FunctionName=function_arn,
             InvocationType='Event',
-            Payload=json.dumps(payload)
+            Payload=orjson.dumps({**body, 'title_ids': shard, 'job_id': job_id})
         )
-        return {"message": f"Lambda function initiated.", "job_id": job_id}, 202
+
+    try:
+        # list() surfaces the first invocation error, if any
+        list(executor.map(invoke_shard, shards))
+        return {"message": f"Lambda function initiated across {len(shards)} shards.", "job_id": job_id}, 202
     except Exception as e:
-        print(f"Error invoking Lambda {function_arn}: {str(e)}")
+        logger.error(f"Error invoking Lambda {function_arn}: {str(e)}")
         return {"message": str(e)}, 500
 
+def build_metric_query(query_id, metric_name, function_name):
+    """Builds a single hourly Sum MetricDataQuery for a Lambda function metric."""
+    return {
+        'Id': query_id,
+        'MetricStat': {
+            'Metric': {
+                'Namespace': 'AWS/Lambda',
+                'MetricName': metric_name,
+                'Dimensions': [{'Name': 'FunctionName', 'Value': function_name}]
+            },
+            'Period': 3600,
+            'Stat': 'Sum',
+        },
+        'ReturnData': True,
+    }
+
+def fetch_metric_values(queries, start_time, end_time):
+    """Runs GetMetricData for the given queries and returns the datapoint values keyed by query Id."""
+    values_by_id = {}
+    paginator = get_client('cloudwatch').get_paginator('get_metric_data')
+    for page in paginator.paginate(MetricDataQueries=queries, StartTime=start_time, EndTime=end_time):
+        for result in page['MetricDataResults']:
+            values_by_id.setdefault(result['Id'], []).extend(result['Values'])
+    return values_by_id
+
 def get_lambda_summaries():
     """Fetches invocation and error counts for the last hour for all configured Lambdas."""
     summaries = []
@@ -76,175 +186,171 @@ def get_lambda_summaries():
     end_time = datetime.utcnow()
     start_time = end_time - timedelta(hours=1)
 
-    for name, arn in LAMBDA_CONFIG.items():
-        if not arn:
-            continue
+    configured = [(name, arn, _ARN_TO_NAME[arn]) for name, arn in LAMBDA_CONFIG.items() if arn]
+    if not configured:
+        return {"lambdas": summaries}, 200
 
-        function_name = arn.split(':')[-1]
-        
-        try:
-            # Fetch Invocations and Errors
-            response = cloudwatch.get_metric_data(
-                MetricDataQueries=[
-                    {
-                        'Id': 'invocations',
-                        'MetricStat': {
-                            'Metric': {
-                                'Namespace': 'AWS/Lambda',
-                                'MetricName': 'Invocations',
-                                'Dimensions': [{'Name': 'FunctionName', 'Value': function_name}]
-                            },
-                            'Period': 3600,
-                            'Stat': 'Sum',
-                        },
-                        'ReturnData': True,
-                    },
-                    {
-                        'Id': 'errors',
-                        'MetricStat': {
-                            'Metric': {
-                                'Namespace': 'AWS/Lambda',
-                                'MetricName': 'Errors',
-                                'Dimensions': [{'Name': 'FunctionName', 'Value': function_name}]
-                            },
-                            'Period': 3600,
-                            'Stat': 'Sum',
-                        },
-                        'ReturnData': True,
-                    }
-                ],
-                StartTime=start_time,
-                EndTime=end_time
-            )
-
-            invocations = 0
-            errors = 0
-
-            if response['MetricDataResults'][0]['Values']:
-                invocations = int(response['MetricDataResults'][0]['Values'][0])
-            
-            if response['MetricDataResults'][1]['Values']:
-                errors = int(response['MetricDataResults'][1]['Values'][0])
-
-            success_count = max(0, invocations - errors)
-            
-            summaries.append({
-                "name": name,
-                "function_name": function_name,
-                "arn": arn,
-                "invocations_1h": invocations,
-                "errors_1h": errors,
-                "success_count_1h": success_count
-            })
+    # One query per (function, metric) so every Lambda is covered by a single GetMetricData call
+    queries = []
+    for i, (_, _, function_name) in enumerate(configured):
+        queries.append(build_metric_query(f'inv_{i}', 'Invocations', function_name))
+        queries.append(build_metric_query(f'err_{i}', 'Errors', function_name))
 
-        except Exception as e:
-            print(f"Error fetching metrics for {function_name}: {str(e)}")
-            # Add with zero values/error state rather than failing the whole request
+    failures = {}
+    try:
+        values_by_id = fetch_metric_values(queries, start_time, end_time)
+    except Exception as e:
+        logger.error(f"Error fetching Lambda metrics in one batch, falling back to per-function queries: {str(e)}")
+        # Query each function concurrently so one failure only marks that function in an error state
+        futures = {
+            i: executor.submit(fetch_metric_values, queries[2 * i:2 * i + 2], start_time, end_time)
+            for i in range(len(configured))
+        }
+        values_by_id = {}
+        for i, future in futures.items():
+            try:
+                values_by_id.update(future.result())
+            except Exception as e:
+                logger.error(f"Error fetching metrics for {configured[i][2]}: {str(e)}")
+                failures[i] = str(e)
+
+    for i, (name, arn, function_name) in enumerate(configured):
+        if i in failures:
+            # Add with error state rather than failing the whole request
             summaries.append({
                 "name": name,
                 "function_name": function_name,
                 "arn": arn,
-                "error": str(e)
+                "error": failures[i]
             })
+            continue
+
+        invocations_values = values_by_id.get(f'inv_{i}')
+        errors_values = values_by_id.get(f'err_{i}')
+        invocations = int(invocations_values[0]) if invocations_values else 0
+        errors = int(errors_values[0]) if errors_values else 0
+
+        success_count = max(0, invocations - errors)
+
+        summaries.append({
+            "name": name,
+            "function_name": function_name,
+            "arn": arn,
+            "invocations_1h": invocations,
+            "errors_1h": errors,
+            "success_count_1h": success_count
+        })
 
     return {"lambdas": summaries}, 200
 
 def get_lambda_logs(body):
-    """Fetches the most recent log stream for a specific Lambda ARN."""
+    """Fetches recent log events, optionally filtered by pattern, for a specific Lambda ARN."""
     function_arn = body.get('function_arn')
     if not function_arn:
         return {"message": "function_arn is required"}, 400
 
     # Security check: ensure the requested ARN is one of our managed ones
-    if function_arn not in LAMBDA_CONFIG.values():
+    if function_arn not in _ALLOWED_ARNS:
         return {"message": "Unauthorized access to function logs"}, 403
 
-    function_name = function_arn.split(':')[-1]
+    function_name = _ARN_TO_NAME[function_arn]
     log_group_name = f"/aws/lambda/{function_name}"
 
+    # Only look back as far as the caller asks (epoch millis), defaulting to the last 15 minutes
+    now_ms = int(time.time() * 1000)
+    since = body.get('since')
+    if since is None:
+        since = now_ms - LOG_DEFAULT_LOOKBACK_SECONDS * 1000
     try:
-        # 1. Get the latest log stream
-        streams_response = logs_client.describe_log_streams(
-            logGroupName=log_group_name,
-            orderBy='LastEventTime',
-            descending=True,
-            limit=1
-        )
-
-        if not streams_response.get('logStreams'):
-            return {"message": "No log streams found", "events": []}, 200
-
-        stream_name = streams_response['logStreams'][0]['logStreamName']
+        since = int(since)
+    except (TypeError, ValueError):
+        return {"message": "since must be an integer timestamp in epoch milliseconds"}, 400
 
-        # 2. Get log events
-        events_response = logs_client.get_log_events(
+    try:
+        # A server-side filtered query across every stream in the group, ending now. Results come oldest
+        # first, so read a bounded number of pages of the window and keep only the most recent events.
+        pages = get_client('logs').get_paginator('filter_log_events').paginate(
             logGroupName=log_group_name,
-            logStreamName=stream_name,
-            limit=20,
-            startFromHead=False 
+            startTime=since,
+            endTime=now_ms,
+            filterPattern=body.get('filter_pattern', ''),
+            PaginationConfig={'PageSize': LOG_PAGE_SIZE, 'MaxItems': LOG_PAGE_SIZE * LOG_MAX_PAGES}
+        )
+        recent_events = heapq.nlargest(
+            LOG_EVENTS_LIMIT,
+            itertools.chain.from_iterable(page.get('events', []) for page in pages),
+            key=lambda event: event['timestamp']
         )
 
         formatted_events = []
-        for event in events_response.get('events', []):
+        for event in reversed(recent_events):
             formatted_events.append({
                 "timestamp": event['timestamp'],
-                "message": event['message']
+                "message": event['message'],
+                "stream_name": event.get('logStreamName')
             })
 
         return {
             "log_group": log_group_name,
-            "stream_name": stream_name,
+            # Stream of the most recent event, as the single-stream response used to return
+            "stream_name": formatted_events[-1]["stream_name"] if formatted_events else None,
             "events": formatted_events
         }, 200
 
-    except logs_client.exceptions.ResourceNotFoundException:
+    except get_client('logs').exceptions.ResourceNotFoundException:
         return {"message": "Log group not found (function may not have run yet)", "events": []}, 200
     except Exception as e:
-        print(f"Error fetching logs for {function_name}: {str(e)}")
+        logger.error(f"Error fetching logs for {function_name}: {str(e)}")
         return {"message": f"Error fetching logs: {str(e)}"}, 500
 
+# --- Routing ---
+
+# Fixed payload for the reference data refresh, pre-encoded so only the job_id is filled in per request
+REFERENCE_REFRESH_TEMPLATE = b'{"refresh_sources":"Y","refresh_genres":"Y","regions":"GB","job_id":"__JOBID__"}'
+
+# Map (HTTP method, path) to a handler taking the parsed request body
+ROUTES = {
+    ('GET', '/admin/dynamodb/summary'): lambda body: get_dynamodb_summary(),
+    ('GET', '/admin/system/lambdas'): lambda body: get_lambda_summaries(),
+    ('POST', '/admin/reference/refresh'): lambda body: trigger_lambda_function(
+        LAMBDA_CONFIG["Reference Data"], payload_template=REFERENCE_REFRESH_TEMPLATE),
+    ('POST', '/admin/titles/refresh'): lambda body: trigger_lambda_function(
+        LAMBDA_CONFIG["Title Ingestion"], payload=body),
+    ('POST', '/admin/titles/enrich'): trigger_enrichment,
+    ('POST', '/admin/system/lambdas/logs'): get_lambda_logs,
+}
+
 # --- Main Handler ---
 
+# Static response parts, built once per execution environment. The headers stay a plain dict
+# because the Lambda runtime serializes the returned response with the standard JSON encoder.
+RESPONSE_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+}
+NOT_FOUND_BODY = orjson.dumps({"message": "Not Found"}).decode()
+INVALID_JSON_BODY = orjson.dumps({"message": "Invalid JSON"}).decode()
+
 def lambda_handler(event, context):
     """Main handler for the admin Lambda function."""
-    print(f"Received event: {json.dumps(event)}")
+    # Arguments are only formatted when DEBUG is enabled
+    logger.debug("Received event: %s", event)
+
+    route = ROUTES.get((event.get('httpMethod'), event.get('path')))
+    if route is None:
+        return {'statusCode': 404, 'headers': RESPONSE_HEADERS, 'body': NOT_FOUND_BODY}
 
-    http_method = event.get('httpMethod')
-    path = event.get('path')
-    
     # Parse body
     body = {}
     if event.get('body'):
         try:
-            body = json.loads(event['body'])
-        except json.JSONDecodeError:
-            return {'statusCode': 400, 'body': json.dumps({"message": "Invalid JSON"})}
-
-    response_body = {"message": "Not Found"}
-    status_code = 404
-
-    if http_method == 'GET':
-        if path == '/admin/dynamodb/summary':
-            response_body, status_code = get_dynamodb_summary()
-        elif path == '/admin/system/lambdas':
-            response_body, status_code = get_lambda_summaries()
-            
-    elif http_method == 'POST':
-        if path == '/admin/reference/refresh':
-            body = {"refresh_sources": "Y", "refresh_genres": "Y", "regions": "GB"}
-            response_body, status_code = trigger_lambda_function(LAMBDA_CONFIG["Reference Data"], payload=body)
-        elif path == '/admin/titles/refresh':
-            response_body, status_code = trigger_lambda_function(LAMBDA_CONFIG["Title Ingestion"], payload=body)
-        elif path == '/admin/titles/enrich':
-            response_body, status_code = trigger_lambda_function(LAMBDA_CONFIG["Title Enrichment"], payload=body)
-        elif path == '/admin/system/lambdas/logs':
-            response_body, status_code = get_lambda_logs(body)
+            body = orjson.loads(event['body'])
+        except orjson.JSONDecodeError:
+            return {'statusCode': 400, 'body': INVALID_JSON_BODY}
+    response_body, status_code = route(body)
 
     return {
         'statusCode': status_code,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps(response_body)
+        'headers': RESPONSE_HEADERS,
+        'body': orjson.dumps(response_body).decode()
     }
\ No newline at end of file
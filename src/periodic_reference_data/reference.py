@@ -1,9 +1,14 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import json
+import orjson
 import boto3
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import time
 
 # Configure logger
 logger = logging.getLogger()
@@ -20,18 +25,32 @@ def mask_arn(arn: str, visible_chars: int = 4) -> str:
 PK_FIELD = 'PK'
 SK_FIELD = 'SK'
 DATA_FIELD = 'data'
+ENTITY_TYPE_FIELD = 'entity_type' # Partition key of the EntityTypeIndex GSI
 SOURCE_PREFIX = 'source:'
 GENRE_PREFIX = 'genre:'
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_WRITE_MAX_RETRIES = 5
 
 # Environment variables
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 WATCHMODE_HOSTNAME = os.environ.get('WATCHMODE_HOSTNAME')
 WATCHMODE_API_KEY_SECRET_ARN = os.environ.get('WATCHMODE_API_KEY_SECRET_ARN')
 AWS_ENDPOINT_URL = os.environ.get('AWS_ENDPOINT_URL') # Check for LocalStack endpoint
+# Port of the AWS Parameters and Secrets Lambda Extension's local cache, when the layer is attached
+SECRETS_EXTENSION_PORT = os.environ.get('PARAMETERS_SECRETS_EXTENSION_HTTP_PORT', '2773')
+
+# Pooled HTTP session so WatchMode connections are kept alive across calls and warm invocations
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+))
 
 # Global AWS clients and fetched API key
 dynamodb_resource = None
 table = None
+dynamodb_client = None
 secrets_manager_client = None
 _cached_watchmode_api_key = None
 
@@ -56,6 +75,8 @@ try:
     # Configure AWS resources the lambda requires
     dynamodb_resource = boto3.resource('dynamodb', **boto3_kwargs)
     table = dynamodb_resource.Table(DYNAMODB_TABLE_NAME)
+    # Thread-safe client (unlike the resource) for the concurrent source and genre writes
+    dynamodb_client = dynamodb_resource.meta.client
     logger.info(f"Successfully initialized DynamoDB table: {DYNAMODB_TABLE_NAME}")
     secrets_manager_client = boto3.client('secretsmanager', **boto3_kwargs)
     logger.info("Successfully initialized Secrets Manager client.")
@@ -64,12 +85,38 @@ except (EnvironmentError, ClientError) as e:
     raise
 
 
+def get_secret_from_extension(secret_id: str) -> str | None:
+    """
+    Read a secret from the AWS Parameters and Secrets Lambda Extension's local cache.
+    Returns None when the extension layer isn't attached or the lookup fails, so callers can fall back to boto3.
+    """
+    session_token = os.environ.get('AWS_SESSION_TOKEN')
+    if not session_token:
+        return None
+    try:
+        response = http_session.get(
+            f'http://localhost:{SECRETS_EXTENSION_PORT}/secretsmanager/get',
+            params={'secretId': secret_id},
+            headers={'X-Aws-Parameters-Secrets-Token': session_token},
+            timeout=1
+        )
+        response.raise_for_status()
+        return response.json()['SecretString']
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logger.info(f"Secrets extension unavailable, falling back to Secrets Manager: {e}")
+        return None
+
+
 def get_watchmode_api_key_secret() -> str:
     """Fetch the WatchMode API key from AWS Secrets Manager, caching it for reuse."""
     global _cached_watchmode_api_key
     if _cached_watchmode_api_key:
         return _cached_watchmode_api_key
 
+    _cached_watchmode_api_key = get_secret_from_extension(WATCHMODE_API_KEY_SECRET_ARN)
+    if _cached_watchmode_api_key:
+        return _cached_watchmode_api_key
+
     if not secrets_manager_client:
         raise ValueError("Secrets Manager client was not initialized. Check WATCHMODE_API_KEY_SECRET_ARN.")
 
@@ -98,7 +145,7 @@ def _fetch_watchmode_data(api_key: str, endpoint: str, params: dict = None) -> l
 
     try:
         logger.info(f"Fetching data from {url} with params: {params if params else 'N/A'}")
-        response = requests.get(url, params=base_params, timeout=10)
+        response = http_session.get(url, params=base_params, timeout=10)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -119,9 +166,22 @@ def get_genres(api_key: str) -> list:
     return _fetch_watchmode_data(api_key, "genres")
 
 
+def _batch_write_chunk(write_requests: list) -> list:
+    """Apply up to 25 put requests with BatchWriteItem, returning any still unprocessed after retries."""
+    request_items = {DYNAMODB_TABLE_NAME: write_requests}
+    for attempt in range(BATCH_WRITE_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(0.05 * 2 ** (attempt - 1))
+        response = dynamodb_client.batch_write_item(RequestItems=request_items)
+        request_items = response.get('UnprocessedItems')
+        if not request_items:
+            return []
+    return request_items[DYNAMODB_TABLE_NAME]
+
+
 def _save_items_to_dynamodb(items_list: list, item_type_prefix: str, item_type_name: str) -> bool:
-    """Save a list of items (like sources or genres) to DynamoDB using a batch writer."""
-    if not table:
+    """Save a list of items (like sources or genres) to DynamoDB in BatchWriteItem chunks."""
+    if not dynamodb_client:
         logger.error(f"DynamoDB table not available for saving {item_type_name}s.")
         return False
 
@@ -129,19 +189,29 @@ def _save_items_to_dynamodb(items_list: list, item_type_prefix: str, item_type_n
         logger.info(f"No {item_type_name} items provided to save.")
         return True # Operation considered successful as there's nothing to do
 
+    # Keyed by PK/SK, as a BatchWriteItem request may not contain the same key twice
+    items_by_key = {}
+    for item in items_list:
+        if not isinstance(item, dict) or 'id' not in item or 'name' not in item:
+            logger.warning(f"Skipping invalid {item_type_name}_item: {item}")
+            continue
+        item_to_save = {
+            PK_FIELD: f'{item_type_prefix}{item["id"]}',
+            SK_FIELD: item["name"],
+            ENTITY_TYPE_FIELD: item_type_name,
+            DATA_FIELD: item
+        }
+        items_by_key[(item_to_save[PK_FIELD], item_to_save[SK_FIELD])] = item_to_save
+
+    write_requests = [{'PutRequest': {'Item': item}} for item in items_by_key.values()]
     try:
-        with table.batch_writer() as batch:
-            for item in items_list:
-                if not isinstance(item, dict) or 'id' not in item or 'name' not in item:
-                    logger.warning(f"Skipping invalid {item_type_name}_item: {item}")
-                    continue
-                item_to_save = {
-                    PK_FIELD: f'{item_type_prefix}{item["id"]}',
-                    SK_FIELD: item["name"],
-                    DATA_FIELD: item
-                }
-                batch.put_item(Item=item_to_save)
-        logger.info(f"Successfully saved {len(items_list)} {item_type_name} items to DynamoDB.")
+        unprocessed_count = 0
+        for i in range(0, len(write_requests), BATCH_WRITE_MAX_ITEMS):
+            unprocessed_count += len(_batch_write_chunk(write_requests[i:i + BATCH_WRITE_MAX_ITEMS]))
+        if unprocessed_count:
+            logger.error(f"Giving up on {unprocessed_count} unprocessed {item_type_name} items after {BATCH_WRITE_MAX_RETRIES} retries.")
+            return False
+        logger.info(f"Successfully saved {len(write_requests)} {item_type_name} items to DynamoDB.")
         return True
     except ClientError as e:
         logger.error(f"DynamoDB batch write error for {item_type_name}s: {e}", exc_info=True)
@@ -189,34 +259,35 @@ def lambda_handler(event, context):
     This function is triggered by an event and fetches data from the WatchMode API,
     then saves it into DynamoDB for application-wide use.
     """
-    logger.info(f"Received event: {json.dumps(event)}")
+    logger.info(f"Received event: {orjson.dumps(event).decode()}")
 
     try:
         api_key = get_watchmode_api_key_secret()
     except Exception as e:
         logger.error(f"Failed to get API key: {e}")
-        return {'statusCode': 500, 'body': json.dumps({'error': f'Failed to retrieve API key: {str(e)}'})}
+        return {'statusCode': 500, 'body': orjson.dumps({'error': f'Failed to retrieve API key: {str(e)}'}).decode()}
 
     messages = []
     all_successful = True
 
     try:
-        source_msg, source_success = _process_source_refresh(api_key, event)
-        if source_msg: messages.append(source_msg)
-        if not source_success: all_successful = False
-
-        genre_msg, genre_success = _process_genre_refresh(api_key, event)
-        if genre_msg: messages.append(genre_msg)
-        if not genre_success: all_successful = False
+        # Sources and genres touch disjoint data, so fetch and save them concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(refresh, api_key, event)
+                       for refresh in (_process_source_refresh, _process_genre_refresh)]
+            for future in futures:
+                msg, success = future.result()
+                if msg: messages.append(msg)
+                if not success: all_successful = False
 
     except Exception as e:
         logger.error(f"An unhandled exception occurred during refresh processing: {e}", exc_info=True)
         messages.append("An unexpected server error occurred.")
-        return {'statusCode': 500, 'body': json.dumps({'messages': messages, 'success': False})}
+        return {'statusCode': 500, 'body': orjson.dumps({'messages': messages, 'success': False}).decode()}
 
     # If no refresh was requested
     if not messages:
         messages.append("No refresh action requested.")
 
     status_code = 200 if all_successful else 500
-    return {'statusCode': status_code, 'body': json.dumps({'messages': messages, 'success': all_successful})}
+    return {'statusCode': status_code, 'body': orjson.dumps({'messages': messages, 'success': all_successful}).decode()}
@@ -1,10 +1,16 @@
 # src/title_enrichment/enrichment.py
 import os
 import boto3
-import json
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 import logging
+import time
 
 # Configure logger
 logger = logging.getLogger()
@@ -15,9 +21,35 @@ DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 WATCHMODE_HOSTNAME = os.environ.get('WATCHMODE_HOSTNAME')
 WATCHMODE_API_KEY_SECRET_ARN = os.environ.get('WATCHMODE_API_KEY_SECRET_ARN')
 AWS_ENDPOINT_URL = os.environ.get('AWS_ENDPOINT_URL') # Check for LocalStack endpoint
+# Port of the AWS Parameters and Secrets Lambda Extension's local cache, when the layer is attached
+SECRETS_EXTENSION_PORT = os.environ.get('PARAMETERS_SECRETS_EXTENSION_HTTP_PORT', '2773')
+# Concurrent WatchMode requests; keep at or below the API's rate limit to avoid 429s
+FETCH_MAX_WORKERS = int(os.environ.get('FETCH_MAX_WORKERS', '16'))
+
+# Pooled HTTP session so WatchMode connections are kept alive across calls and warm invocations
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+))
+
+# Shared pool for concurrent WatchMode lookups, reused across warm invocations
+executor = ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS)
+
+# Titles rated above this are also indexed under rec_index:{source_id}:{genre_id} for the recommendations query.
+# The rows expire like the consumer's source/genre index rows, and are removed sooner when enrichment finds
+# the title no longer qualifies or no longer has that source/genre combination.
+RECOMMENDATION_MIN_RATING = Decimal('7')
+REC_INDEX_PREFIX = 'rec_index:'
+INDEX_TTL_SECONDS = int(os.environ.get('INDEX_TTL_DAYS', '30')) * 86400
+# Attribute on the title record holding the rec_index partitions it was last indexed under
+REC_INDEX_PKS_FIELD = 'rec_index_pks'
 
 # --- Global Clients & Cache ---
 _cached_api_key = None
+dynamodb_resource = None
+dynamodb_client = None
 table = None
 kinesis_client = None
 secrets_manager_client = None
@@ -33,8 +65,12 @@ try:
     # Initialise DynamoDB
     if not DYNAMODB_TABLE_NAME:
         raise EnvironmentError("DYNAMODB_TABLE_NAME environment variable must be set.")
-    dynamodb_resource = boto3.resource('dynamodb', **boto3_kwargs)
+    # Every fetch worker can hold its own connection for the concurrent title updates
+    boto_config = Config(max_pool_connections=max(10, FETCH_MAX_WORKERS))
+    dynamodb_resource = boto3.resource('dynamodb', config=boto_config, **boto3_kwargs)
     table = dynamodb_resource.Table(DYNAMODB_TABLE_NAME)
+    # Resources aren't thread-safe, but their client is; it keeps the resource's Python-native (de)serialization
+    dynamodb_client = dynamodb_resource.meta.client
     logger.info(f"Successfully initialized DynamoDB table client for: {DYNAMODB_TABLE_NAME}")
 
 
@@ -47,6 +83,28 @@ except Exception as e:
     logger.error(f"Error during AWS client initialization: {e}", exc_info=True)
     raise
 
+def get_secret_from_extension(secret_id: str) -> str | None:
+    """
+    Read a secret from the AWS Parameters and Secrets Lambda Extension's local cache.
+    Returns None when the extension layer isn't attached or the lookup fails, so callers can fall back to boto3.
+    """
+    session_token = os.environ.get('AWS_SESSION_TOKEN')
+    if not session_token:
+        return None
+    try:
+        response = http_session.get(
+            f'http://localhost:{SECRETS_EXTENSION_PORT}/secretsmanager/get',
+            params={'secretId': secret_id},
+            headers={'X-Aws-Parameters-Secrets-Token': session_token},
+            timeout=1
+        )
+        response.raise_for_status()
+        return response.json()['SecretString']
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logger.info(f"Secrets extension unavailable, falling back to Secrets Manager: {e}")
+        return None
+
+
 def get_api_key() -> str:
     """Fetch the WatchMode API key from AWS Secrets Manager, caching it for reuse."""
     global _cached_api_key
@@ -55,6 +113,11 @@ def get_api_key() -> str:
 
     if not WATCHMODE_API_KEY_SECRET_ARN:
         raise ValueError("WATCHMODE_API_KEY_SECRET_ARN environment variable not set.")
+
+    _cached_api_key = get_secret_from_extension(WATCHMODE_API_KEY_SECRET_ARN)
+    if _cached_api_key:
+        return _cached_api_key
+
     if not secrets_manager_client:
         raise RuntimeError("Secrets Manager client was not initialized. Check environment variables.")
 
@@ -71,62 +134,153 @@ def fetch_title_details(api_key, title_id):
     url = f'{WATCHMODE_HOSTNAME}/v1/title/{title_id}/details/'
     params = {"apiKey": api_key, "append_to_response": "sources"}
     try:
-        response = requests.get(url, params=params, timeout=10)
+        response = http_session.get(url, params=params, timeout=10)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching details for title {title_id}: {e}")
         return None
 
+def update_title(key, details):
+    """
+    Sets the enrichment fields on a title record, returning the updated item.
+    Only the enrichment fields are written, so concurrent writes to the rest of the record are kept.
+    Returns None if the record no longer exists or the update fails.
+    """
+    pk, sk = key
+    # Convert float to Decimal for DynamoDB, handling None values.
+    # It's safer to convert via a string to avoid precision issues.
+    user_rating = details.get('user_rating')
+    rating_to_save = Decimal(str(user_rating)) if user_rating is not None else Decimal('0')
+
+    try:
+        response = dynamodb_client.update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={'PK': pk, 'SK': sk},
+            UpdateExpression="SET #data.plot_overview = :plot, #data.poster = :poster, #data.user_rating = :rating",
+            ConditionExpression='attribute_exists(PK)', # Don't recreate records deleted in the meantime
+            ExpressionAttributeNames={
+                '#data': 'data'
+            },
+            ExpressionAttributeValues={
+                ':plot': details.get('plot_overview', 'N/A'),
+                ':poster': details.get('poster', 'N/A'),
+                ':rating': rating_to_save
+            },
+            ReturnValues='ALL_NEW'
+        )
+        return response['Attributes']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.warning(f"Title record {pk} no longer exists. Skipping.")
+        else:
+            logger.error(f"Failed to enrich record {pk}: {e}", exc_info=True)
+        return None
+
+def rec_index_pks(item):
+    """Returns the recommendation index partitions for a title, one per source/genre combination in its data."""
+    data = item['data']
+    genre_ids = set(data.get('genre_ids') or [])
+    return {
+        f"{REC_INDEX_PREFIX}{source_id}:{genre_id}"
+        for source_id in set(data.get('source_ids') or [])
+        for genre_id in genre_ids
+    }
+
+def is_recommendation(item):
+    """Whether an enriched title is rated highly enough to be recommended."""
+    return item['data']['user_rating'] > RECOMMENDATION_MIN_RATING
+
+def record_rec_index_pks(pk, sk, index_pks):
+    """Stores the rec_index partitions a title is now indexed under on its record, so the next enrichment can remove stale rows."""
+    # DynamoDB sets can't be empty, so a title that is no longer indexed has the attribute removed
+    update_kwargs = {
+        'UpdateExpression': 'SET #pks = :pks',
+        'ExpressionAttributeValues': {':pks': index_pks}
+    } if index_pks else {'UpdateExpression': 'REMOVE #pks'}
+    try:
+        dynamodb_client.update_item(
+            TableName=DYNAMODB_TABLE_NAME,
+            Key={'PK': pk, 'SK': sk},
+            ConditionExpression='attribute_exists(PK)',
+            ExpressionAttributeNames={'#pks': REC_INDEX_PKS_FIELD},
+            **update_kwargs
+        )
+    except ClientError as e:
+        # The index rows still expire through their TTL if they can't be tracked here
+        logger.warning(f"Could not record the recommendation index partitions of {pk}: {e}")
+
+def enrich_titles(api_key, keys):
+    """
+    Fetches details for the canonical title records and updates them concurrently,
+    then adds the highly rated ones to the recommendation index (and removes the rest) in a batch.
+    """
+    # A batch can carry the same title more than once; look each one up only once
+    keys = list(dict.fromkeys(keys))
+    title_ids = [pk.split(':', 1)[1] for pk, _ in keys]
+    logger.info("Enriching %d titles", len(title_ids))
+    logger.debug("Enriching title IDs: %s", title_ids)
+
+    # The lookups are pure I/O, so run them concurrently over the shared session
+    lookups = executor.map(lambda title_id: fetch_title_details(api_key, title_id), title_ids)
+
+    details_by_key = {}
+    for key, title_id, details in zip(keys, title_ids, lookups):
+        if not details:
+            logger.warning(f"Could not fetch details for title {title_id}. Skipping.")
+            continue
+        details_by_key[key] = details
+
+    if not details_by_key:
+        return
+
+    # Each update only touches its own record, so they run concurrently on the shared pool
+    updated_items = [
+        item for item in executor.map(lambda key_details: update_title(*key_details), details_by_key.items())
+        if item
+    ]
+
+    index_expires_at = int(time.time()) + INDEX_TTL_SECONDS
+    changed_index_pks = []
+    try:
+        with table.batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+            for item in updated_items:
+                current_pks = rec_index_pks(item) if is_recommendation(item) else set()
+                for index_pk in current_pks:
+                    batch.put_item(Item={'PK': index_pk, 'SK': item['PK'], 'ttl': index_expires_at})
+                # A re-enriched title can drop below the threshold, or its source/genre ids can have changed since it
+                # was last indexed; remove those rows too. Deleting absent rows is a no-op.
+                previous_pks = set(item.get(REC_INDEX_PKS_FIELD) or ())
+                for index_pk in (previous_pks | rec_index_pks(item)) - current_pks:
+                    batch.delete_item(Key={'PK': index_pk, 'SK': item['PK']})
+                if current_pks != previous_pks:
+                    changed_index_pks.append((item['PK'], item['SK'], current_pks))
+        logger.info(f"Successfully enriched {len(updated_items)} titles.")
+    except Exception as e:
+        logger.error(f"Failed to write recommendation index items: {e}", exc_info=True)
+        return
+
+    # Only once the rows are written, so after a failed batch the record still lists the partitions to clean up
+    list(executor.map(lambda change: record_rec_index_pks(*change), changed_index_pks))
+
 def lambda_handler(event, context):
     """
     Consumes DynamoDB stream events to enrich title records with more details.
+    Can also be invoked directly (e.g. by the admin Lambda) with a list of 'title_ids' to enrich.
     """
     api_key = get_api_key()
 
-    for record in event.get('Records', []):
-        if record.get('eventName') != 'INSERT':
-            continue
+    if 'title_ids' in event:
+        title_ids = event.get('title_ids') or []
+        enrich_titles(api_key, [(f'title:{title_id}', 'record') for title_id in title_ids])
+        return {'statusCode': 200, 'body': orjson.dumps({'message': f"Processed {len(title_ids)} titles."}).decode()}
 
-        new_image = record.get('dynamodb', {}).get('NewImage', {})
-        pk = new_image.get('PK', {}).get('S')
-        sk = new_image.get('SK', {}).get('S')
+    # The event source mapping's FilterCriteria only delivers INSERTs of canonical title records
+    keys = []
+    for record in event.get('Records', []):
+        new_image = record['dynamodb']['NewImage']
+        keys.append((new_image['PK']['S'], new_image['SK']['S']))
 
-        # Only process the canonical records, not the index records
-        if not pk or not pk.startswith('title:') or sk != 'record':
-            continue
+    enrich_titles(api_key, keys)
 
-        try:
-            title_id = pk.split(':', 1)[1]
-            logger.info(f"Enriching title ID: {title_id}")
-
-            details = fetch_title_details(api_key, title_id)
-            if not details:
-                logger.warning(f"Could not fetch details for title {title_id}. Skipping.")
-                continue
-
-            # Convert float to Decimal for DynamoDB, handling None values.
-            # It's safer to convert via a string to avoid precision issues.
-            user_rating = details.get('user_rating')
-            rating_to_save = Decimal(str(user_rating)) if user_rating is not None else Decimal('0')
-
-            # Update the original item with the new details
-            table.update_item(
-                Key={'PK': pk, 'SK': sk},
-                UpdateExpression="SET #data.plot_overview = :plot, #data.poster = :poster, #data.user_rating = :rating",
-                ExpressionAttributeNames={
-                    '#data': 'data'
-                },
-                ExpressionAttributeValues={
-                    ':plot': details.get('plot_overview', 'N/A'),
-                    ':poster': details.get('poster', 'N/A'),
-                    ':rating': rating_to_save
-                }
-            )
-            logger.info(f"Successfully enriched title ID: {title_id}")
-
-        except Exception as e:
-            logger.error(f"Failed to process record {pk}: {e}", exc_info=True)
-            # Continue to next record
-
-    return {'statusCode': 200, 'body': json.dumps({'message': f"Processed {len(event.get('Records', []))} records."})}
+    return {'statusCode': 200, 'body': orjson.dumps({'message': f"Processed {len(event.get('Records', []))} records."}).decode()}
@@ -1,7 +1,9 @@
-import json
 import base64
+import orjson
+import zstandard
 import logging
 import os
+import time
 import boto3
 from botocore.exceptions import ClientError
 
@@ -13,6 +15,13 @@ logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 AWS_ENDPOINT_URL = os.environ.get('AWS_ENDPOINT_URL')
 TITLE_PREFIX = 'title:'
+# Ingestion zstd-compresses record Data; plain JSON records (e.g. from older producers) are still accepted
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+record_decompressor = zstandard.ZstdDecompressor()
+# Index rows expire unless re-ingested within this window; canonical records never expire
+INDEX_TTL_SECONDS = int(os.environ.get('INDEX_TTL_DAYS', '30')) * 86400
+# Items written per checkpoint (four full BatchWriteItem requests); a failed checkpoint is retried from its first record
+CHECKPOINT_ITEMS = 100
 
 table = None
 try:
@@ -27,72 +36,103 @@ except Exception as e:
     logger.error(f"Error during AWS client initialization: {e}", exc_info=True)
     raise
 
+def build_title_items(title_payload, index_expires_at):
+    """Returns the canonical record and inverted index items to write for a title payload."""
+    # --- The canonical record ---
+    items = [{
+        'PK': f"{TITLE_PREFIX}{title_payload['id']}",
+        'SK': 'record',
+        'data': title_payload
+    }]
+
+    # --- The inverted index records ---
+    #    They contain no mutable data, so enrichment is simple.
+    source_ids = title_payload.get('source_ids', [])
+    genre_ids = title_payload.get('genre_ids', [])
+
+    if not source_ids or not genre_ids:
+        # This warning is expected if the upstream payload is incomplete
+        return items
+
+    index_sk = f"{TITLE_PREFIX}{title_payload['id']}"
+    for source_id in set(source_ids):
+        source_prefix = f"source:{source_id}:genre:"
+        for genre_id in set(genre_ids):
+            # This record enables the 'recommendations' query pattern
+            items.append({
+                'PK': f"{source_prefix}{genre_id}",
+                'SK': index_sk,
+                'ttl': index_expires_at
+            })
+    return items
+
+def write_items(items):
+    """Writes the items through a batch_writer, which flushes everything by the time it exits."""
+    # overwrite_by_pkeys collapses duplicate keys within each buffered batch
+    with table.batch_writer(overwrite_by_pkeys=['PK', 'SK']) as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
 def lambda_handler(event, context):
     """
-    Consumes title recommendation events from a Kinesis stream and logs them.
+    Consumes title recommendation events from a Kinesis stream and saves them to DynamoDB.
+    Writes are committed in checkpoints; if one fails, only the records from that checkpoint
+    onwards are reported back to Lambda for retry.
     """
     logger.info(f"Received {len(event.get('Records', []))} records from Kinesis.")
 
-    records_to_save = []
+    saved_count = 0
+    index_expires_at = int(time.time()) + INDEX_TTL_SECONDS
+    pending_items = []
+    pending_sequence_numbers = []
+
+    def commit_pending():
+        """Writes the pending items, returning the batch failure response if the write fails."""
+        try:
+            write_items(pending_items)
+        except ClientError as e:
+            logger.error(f"Failed to save titles to DynamoDB: {e}", exc_info=True)
+            # Kinesis retries from the lowest reported sequence number, so report where this checkpoint began
+            return {'batchItemFailures': [{'itemIdentifier': pending_sequence_numbers[0]}]}
+        pending_items.clear()
+        pending_sequence_numbers.clear()
+        return None
+
     for record in event.get('Records', []):
         try:
             # Kinesis data is base64 encoded
             payload_bytes = base64.b64decode(record.get('kinesis', {}).get('data'))
-            event_data = json.loads(payload_bytes.decode('utf-8'))
-            title_payload = event_data.get('payload')
-
-            if title_payload and 'id' in title_payload:
-                records_to_save.append(title_payload)
-                logger.info(f"Queued title for saving: {title_payload.get('title')} (ID: {title_payload.get('id')})")
-            else:
-                logger.warning(f"Skipping record with missing payload or ID: {event_data}")
-
-        except (TypeError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            if payload_bytes.startswith(ZSTD_MAGIC):
+                payload_bytes = record_decompressor.decompress(payload_bytes)
+            # orjson parses the raw bytes directly, rejecting invalid UTF-8 as a decode error
+            event_data = orjson.loads(payload_bytes)
+        except (TypeError, orjson.JSONDecodeError, zstandard.ZstdError) as e:
             logger.error(f"Failed to decode or parse Kinesis record data: {e}")
             # Continue to the next record without failing the whole batch
             continue
 
-    if records_to_save:
-        try:
-            processed_keys = set() # Use a set to track keys we've already added to the batch
-            with table.batch_writer() as batch:
-                for title_payload in records_to_save:
-                    # --- De-duplicate and write the canonical record ---
-                    canonical_pk = f"{TITLE_PREFIX}{title_payload['id']}"
-                    canonical_sk = 'record'
-                    if (canonical_pk, canonical_sk) not in processed_keys:
-                        batch.put_item(Item={
-                            'PK': canonical_pk,
-                            'SK': canonical_sk,
-                            'data': title_payload
-                        })
-                        processed_keys.add((canonical_pk, canonical_sk))
-                    # --- De-duplicate and write the inverted index records ---
-                    #    They contain no mutable data, so enrichment is simple.
-                    source_ids = title_payload.get('source_ids', [])
-                    genre_ids = title_payload.get('genre_ids', [])
-
-                    if not source_ids or not genre_ids:
-                        # This warning is expected if the upstream payload is incomplete
-                        continue
-
-                    for source_id in source_ids:
-                        for genre_id in genre_ids:
-                            index_pk = f"source:{source_id}:genre:{genre_id}"
-                            index_sk = f"title:{title_payload['id']}"
-                            if (index_pk, index_sk) not in processed_keys:
-                                # This record enables the 'recommendations' query pattern
-                                batch.put_item(Item={
-                                    'PK': index_pk,
-                                    'SK': index_sk
-                                })
-                                processed_keys.add((index_pk, index_sk))
-
-            logger.info(f"Successfully processed {len(records_to_save)} titles for DynamoDB.")
-        except ClientError as e:
-            logger.error(f"Failed to save titles to DynamoDB: {e}", exc_info=True)
-            raise
+        title_payload = event_data.get('payload')
+        if not title_payload or 'id' not in title_payload:
+            logger.warning(f"Skipping record with missing payload or ID: {event_data}")
+            continue
+
+        pending_items.extend(build_title_items(title_payload, index_expires_at))
+        pending_sequence_numbers.append(record['kinesis']['sequenceNumber'])
+        saved_count += 1
+        # Per-record detail at debug level, formatted lazily; the batch is summarised once below
+        logger.debug("Queued title for saving: %s (ID: %s)", title_payload.get('title'), title_payload.get('id'))
+
+        if len(pending_items) >= CHECKPOINT_ITEMS:
+            failure = commit_pending()
+            if failure:
+                return failure
+
+    if pending_items:
+        failure = commit_pending()
+        if failure:
+            return failure
+
+    if saved_count:
+        logger.info(f"Successfully processed {saved_count} titles for DynamoDB.")
 
-    return {
-        'message': f"Successfully processed {len(event.get('Records', []))} records."
-    }
\ No newline at end of file
+    return {'batchItemFailures': []}
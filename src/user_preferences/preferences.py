@@ -1,9 +1,14 @@
-import json
+import hashlib
+import orjson
 import os
+import time
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import logging
 import decimal
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # Configure logger
 logger = logging.getLogger()
@@ -12,14 +17,33 @@ logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
 # Environment variables
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 AWS_ENDPOINT_URL = os.environ.get('AWS_ENDPOINT_URL')
+# Sources and genres only change on the daily reference refresh, so warm containers reuse them for this long
+REF_DATA_TTL_SECONDS = max(1, int(os.environ.get('REF_DATA_TTL_SECONDS', '300')))
 
 # Constants
 USER_PREF_PREFIX = 'userpref:'
 SOURCE_PREFIX = 'source:'
 GENRE_PREFIX = 'genre:'
+# GSI keyed on entity_type (e.g. 'source', 'genre', 'userpref') so entities are queried rather than scanned
+ENTITY_TYPE_INDEX = 'EntityTypeIndex'
+USER_PREF_ENTITY_TYPE = 'userpref'
+# Per-user item holding a hash of the stored preference SKs, so repeated identical PUTs skip the query
+PREFS_SUMMARY_SK = 'summary'
+# Mixed into the hash; bumped when a stored hash no longer guarantees the items are complete,
+# e.g. v2 also guarantees every kept item carries entity_type
+PREFS_HASH_VERSION = b'prefs-v2'
+# Malformed SKs are logged as a count plus this many examples, so a corrupt partition can't flood the logs
+MALFORMED_SK_LOG_SAMPLE = 10
+# BatchWriteItem accepts at most 25 put/delete requests; unprocessed ones are retried with exponential backoff
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_WRITE_MAX_RETRIES = 5
+
+# Keep-alive connections and adaptive retries, shared by every client in the execution environment
+boto_config = Config(max_pool_connections=64, tcp_keepalive=True, retries={'mode': 'adaptive', 'max_attempts': 5})
 
 # Global AWS clients
 table = None
+dynamodb_client = None
 
 # Initialization block
 try:
@@ -30,21 +54,25 @@ try:
         logger.info(f"Using LocalStack endpoint for DynamoDB: {AWS_ENDPOINT_URL}")
         boto3_kwargs['endpoint_url'] = AWS_ENDPOINT_URL
 
-    dynamodb_resource = boto3.resource('dynamodb', **boto3_kwargs)
+    dynamodb_resource = boto3.resource('dynamodb', config=boto_config, **boto3_kwargs)
     table = dynamodb_resource.Table(DYNAMODB_TABLE_NAME)
+    # Resources aren't thread-safe, so the pool workers use the resource's client, which is;
+    # it keeps the resource's Python-native (de)serialization
+    dynamodb_client = dynamodb_resource.meta.client
     logger.info(f"Successfully initialized DynamoDB table client for: {DYNAMODB_TABLE_NAME}")
 except (EnvironmentError, ClientError) as e:
     logger.error(f"Initialization error: {e}", exc_info=True)
     raise
 
+# Shared pool for concurrent BatchWriteItem chunks, reused across warm invocations
+executor = ThreadPoolExecutor(max_workers=8)
 
-class DecimalEncoder(json.JSONEncoder):
-    """Custom JSON Encoder to handle DynamoDB's Decimal type."""
 
-    def default(self, o):
-        if isinstance(o, decimal.Decimal):
-            return int(o) if o % 1 == 0 else float(o)
-        return super(DecimalEncoder, self).default(o)
+def decimal_default(o):
+    """orjson default hook to handle DynamoDB's Decimal type."""
+    if isinstance(o, decimal.Decimal):
+        return int(o) if o % 1 == 0 else float(o)
+    raise TypeError
 
 
 def build_response(status_code, body):
@@ -55,29 +83,43 @@ def build_response(status_code, body):
             "Content-Type": "application/json",
             "Access-Control-Allow-Origin": "*",
         },
-        "body": json.dumps(body, cls=DecimalEncoder)
+        "body": orjson.dumps(body, default=decimal_default).decode()
     }
 
 
-def get_entities(pk_prefix: str):
-    """Scan DynamoDB for all entities with a given PK prefix, such as 'source:'."""
-    try:
-        response = table.scan(
-            FilterExpression="begins_with(PK, :pk_prefix)",
-            ExpressionAttributeValues={":pk_prefix": pk_prefix}
-        )
-        items = response.get('Items', [])
+def _query_entities(pk_prefix: str) -> list:
+    """Query the EntityTypeIndex for the data of every entity with a given PK prefix."""
+    query_kwargs = {
+        'IndexName': ENTITY_TYPE_INDEX,
+        'KeyConditionExpression': "entity_type = :entity_type",
+        'ExpressionAttributeValues': {":entity_type": pk_prefix.rstrip(':')},
+        # Only the data map is returned; 'data' is a reserved word so it needs a placeholder
+        'ProjectionExpression': '#data',
+        'ExpressionAttributeNames': {'#data': 'data'}
+    }
+    response = table.query(**query_kwargs)
+    items = response.get('Items', [])
+
+    while 'LastEvaluatedKey' in response:
+        response = table.query(**query_kwargs, ExclusiveStartKey=response['LastEvaluatedKey'])
+        items.extend(response.get('Items', []))
+
+    return [item.get('data', {}) for item in items]
 
-        while 'LastEvaluatedKey' in response:
-            response = table.scan(
-                FilterExpression="begins_with(PK, :pk_prefix)",
-                ExpressionAttributeValues={":pk_prefix": pk_prefix},
-                ExclusiveStartKey=response['LastEvaluatedKey']
-            )
-            items.extend(response.get('Items', []))
 
-        clean_items = [item.get('data', {}) for item in items]
-        return build_response(200, clean_items)
+@lru_cache(maxsize=8)
+def _entities_response(pk_prefix: str, time_bucket: int) -> dict:
+    """
+    Build the serialized response for an entity type.
+    Cached per time bucket so warm containers skip both the query and serialization; errors are not cached.
+    """
+    return build_response(200, _query_entities(pk_prefix))
+
+
+def get_entities(pk_prefix: str):
+    """Get all entities with a given PK prefix, such as 'source:'."""
+    try:
+        return _entities_response(pk_prefix, int(time.time()) // REF_DATA_TTL_SECONDS)
 
     except ClientError as e:
         logger.error(f"DynamoDB ClientError getting entities: {e}", exc_info=True)
@@ -92,8 +134,11 @@ def _get_user_preferences_items(user_id: str) -> list:
     pk = f"{USER_PREF_PREFIX}{user_id}"
     logger.info(f"Querying for raw preference items with PK: {pk}")
     try:
-        response = table.query(KeyConditionExpression=boto3.dynamodb.conditions.Key('PK').eq(pk))
-        logger.info(f"Query response: {response}")
+        response = table.query(
+            KeyConditionExpression=boto3.dynamodb.conditions.Key('PK').eq(pk),
+            ProjectionExpression='SK, entity_type' # The SK carries the preference; entity_type shows if it's indexed
+        )
+        logger.debug("Query response: %s", response)
         return response.get('Items', [])
     except ClientError as e:
         logger.error(f"DynamoDB error in _get_user_preferences_items for user {user_id}: {e}", exc_info=True)
@@ -106,18 +151,14 @@ def get_user_preferences(user_id: str):
     try:
         items = _get_user_preferences_items(user_id)
 
-        preferences = {"sources": [], "genres": []}
-        for item in items:
-            sk = item.get('SK', '')
-            try:
-                prefix, pref_id = sk.split(':', 1)
-                if prefix == 'source':
-                    preferences["sources"].append(pref_id)
-                elif prefix == 'genre':
-                    preferences["genres"].append(pref_id)
-            except ValueError:
-                logger.warning(f"Skipping malformed SK in user preferences: {sk}")
-                continue
+        sks = [item.get('SK', '') for item in items]
+        preferences = {
+            "sources": [sk[len(SOURCE_PREFIX):] for sk in sks if sk.startswith(SOURCE_PREFIX)],
+            "genres": [sk[len(GENRE_PREFIX):] for sk in sks if sk.startswith(GENRE_PREFIX)]
+        }
+        malformed = [sk for sk in sks if sk != PREFS_SUMMARY_SK and not sk.startswith((SOURCE_PREFIX, GENRE_PREFIX))]
+        if malformed:
+            logger.warning(f"Skipping {len(malformed)} malformed SKs in user preferences, e.g. {malformed[:MALFORMED_SK_LOG_SAMPLE]}")
 
         return build_response(200, preferences)
     except ClientError as e:
@@ -125,40 +166,81 @@ def get_user_preferences(user_id: str):
         return build_response(500, {'error': 'Could not retrieve preferences'})
 
 
+def _batch_write_chunk(write_requests: list) -> list:
+    """Apply up to 25 put/delete requests with BatchWriteItem, returning any still unprocessed after retries."""
+    request_items = {DYNAMODB_TABLE_NAME: write_requests}
+    for attempt in range(BATCH_WRITE_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(0.05 * 2 ** (attempt - 1))
+        response = dynamodb_client.batch_write_item(RequestItems=request_items)
+        request_items = response.get('UnprocessedItems')
+        if not request_items:
+            return []
+    return request_items[DYNAMODB_TABLE_NAME]
+
+
+def _batch_write(write_requests: list) -> bool:
+    """Apply put/delete requests in concurrent BatchWriteItem chunks, returning True if every request was written."""
+    chunks = [write_requests[i:i + BATCH_WRITE_MAX_ITEMS] for i in range(0, len(write_requests), BATCH_WRITE_MAX_ITEMS)]
+    unprocessed_count = sum(len(unprocessed) for unprocessed in executor.map(_batch_write_chunk, chunks))
+    if unprocessed_count:
+        logger.warning(f"Giving up on {unprocessed_count} unprocessed write requests after {BATCH_WRITE_MAX_RETRIES} retries.")
+    return not unprocessed_count
+
+
+def _prefs_hash(prefs_sk_set: set) -> str:
+    """Return a stable hash of a set of preference SKs."""
+    return hashlib.blake2b(orjson.dumps(sorted(prefs_sk_set)), digest_size=16, person=PREFS_HASH_VERSION).hexdigest()
+
+
 def set_user_preferences(user_id: str, body: dict):
     """Calculate the delta between old and new preferences and update DynamoDB in a batch."""
     try:
-        # 1. Get existing preferences internal helper
-        existing_items = _get_user_preferences_items(user_id)
-        existing_prefs_sk_set = {item['SK'] for item in existing_items}
-
-        # 2. Prepare the new preferences from the request body.
+        # 1. Prepare the new preferences from the request body.
         new_sources = body.get('sources', [])
         new_genres = body.get('genres', [])
         new_prefs_sk_set = {f"source:{s}" for s in new_sources} | {f"genre:{g}" for g in new_genres}
 
-        # 3. Calculate the delta: what to add and what to delete.
-        items_to_add = new_prefs_sk_set - existing_prefs_sk_set
-        items_to_delete = existing_prefs_sk_set - new_prefs_sk_set
+        # 2. If the stored hash matches, the preferences are unchanged and the query can be skipped.
+        pk = f"{USER_PREF_PREFIX}{user_id}"
+        summary_key = {'PK': pk, 'SK': PREFS_SUMMARY_SK}
+        new_prefs_hash = _prefs_hash(new_prefs_sk_set)
+        summary = table.get_item(Key=summary_key, ProjectionExpression='prefs_hash').get('Item')
+        if summary and summary.get('prefs_hash') == new_prefs_hash:
+            logger.info("Preferences hash unchanged. Exiting.")
+            return build_response(204, {})
 
-        logger.info(f"Items to add: {items_to_add}")
-        logger.info(f"Items to delete: {items_to_delete}")
+        # 3. Get existing preferences from the items themselves, so any divergence from an earlier
+        #    partial or concurrent write is repaired by this delta.
+        existing_items = _get_user_preferences_items(user_id)
+        existing_prefs_sk_set = {item['SK'] for item in existing_items if item['SK'] != PREFS_SUMMARY_SK}
 
-        # If there's nothing to do, exit early.
-        if not items_to_add and not items_to_delete:
-            logger.info("No preference changes detected. Exiting.")
-            return build_response(204, {})
+        # 4. Calculate the delta: what to add and what to delete. Kept items written before the
+        #    EntityTypeIndex existed have no entity_type, so they are re-put to enter the index.
+        untagged_sk_set = {item['SK'] for item in existing_items if item.get('entity_type') != USER_PREF_ENTITY_TYPE}
+        items_to_add = (new_prefs_sk_set - existing_prefs_sk_set) | (new_prefs_sk_set & untagged_sk_set)
+        items_to_delete = existing_prefs_sk_set - new_prefs_sk_set
 
-        # 4. Use the batch_writer to efficiently apply only the changes.
-        with table.batch_writer() as batch:
-            pk = f"{USER_PREF_PREFIX}{user_id}"
-            for sk in items_to_delete:
-                logger.info(f"Queueing delete for user {user_id}, item {sk}")
-                batch.delete_item(Key={'PK': pk, 'SK': sk})
+        logger.info("Queued %d puts, %d deletes for user %s", len(items_to_add), len(items_to_delete), user_id)
+        logger.debug("Items to add: %s, items to delete: %s", items_to_add, items_to_delete)
+
+        # 5. Apply only the changes, with the BatchWriteItem chunks sent concurrently.
+        if items_to_add or items_to_delete:
+            # Drop the stored hash first so a partial write can never be mistaken for the old preferences
+            if summary:
+                table.delete_item(Key=summary_key)
+            write_requests = (
+                [{'DeleteRequest': {'Key': {'PK': pk, 'SK': sk}}} for sk in items_to_delete]
+                + [{'PutRequest': {'Item': {'PK': pk, 'SK': sk, 'entity_type': USER_PREF_ENTITY_TYPE}}} for sk in items_to_add]
+            )
+            if not _batch_write(write_requests):
+                logger.error(f"Some preference changes for user {user_id} could not be written.")
+                return build_response(500, {'error': 'Could not set preferences'})
+        else:
+            logger.info("No preference changes detected.")
 
-            for sk in items_to_add:
-                logger.info(f"Queueing put for user {user_id}, item {sk}")
-                batch.put_item(Item={'PK': pk, 'SK': sk})
+        # 6. Record the hash only once the items match it.
+        table.put_item(Item={**summary_key, 'prefs_hash': new_prefs_hash})
 
     except ClientError as e:
         logger.error(f"DynamoDB error setting preferences for user {user_id}: {e}", exc_info=True)
@@ -180,7 +262,7 @@ def lambda_handler(event, context):
      This function acts as a router, directing incoming requests to the appropriate
      logic based on the HTTP method and path.
      """
-    logger.info(f"Received event: {json.dumps(event)}")
+    logger.info(f"Received event: {orjson.dumps(event).decode()}")
 
     http_method = event.get('httpMethod')
     path = event.get('path')
@@ -205,9 +287,9 @@ def lambda_handler(event, context):
             return get_user_preferences(user_id)
         elif http_method == 'PUT':
             try:
-                body = json.loads(event.get('body') or '{}')
+                body = orjson.loads(event.get('body') or '{}')
                 return set_user_preferences(user_id, body)
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 logger.warning("Received invalid JSON in PUT /preferences body")
                 return build_response(400, {"error": "Invalid JSON format"})
 
@@ -1,11 +1,14 @@
-import json
+import orjson
 import os
+import time
 import boto3
-import requests
+import zstandard
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import lru_cache
 
 # Configure logger
 logger = logging.getLogger()
@@ -19,12 +22,26 @@ WATCHMODE_API_KEY_SECRET_ARN = os.environ.get('WATCHMODE_API_KEY_SECRET_ARN')
 AWS_ENDPOINT_URL = os.environ.get('AWS_ENDPOINT_URL') # Check for LocalStack endpoint
 API_FETCH_LIMIT = int(os.environ.get('API_FETCH_LIMIT', '20'))
 USER_PREF_PREFIX = 'userpref:'
+SOURCE_PREFIX = 'source:'
+GENRE_PREFIX = 'genre:'
+KINESIS_MAX_RECORDS_PER_PUT = 500
+KINESIS_PUT_MAX_WORKERS = 8
+# Attempts per chunk before records that Kinesis keeps rejecting (e.g. throttled shards) fail the run
+KINESIS_PUT_MAX_ATTEMPTS = 5
+# Record Data is zstd-compressed JSON; the consumer detects the zstd frame and decompresses it
+record_compressor = zstandard.ZstdCompressor(level=3)
+# GSI keyed on entity_type; user preference items carry entity_type 'userpref'
+ENTITY_TYPE_INDEX = 'EntityTypeIndex'
+USER_PREF_ENTITY_TYPE = 'userpref'
+# Malformed SKs are logged as a count plus this many examples, so a corrupt partition can't flood the logs
+MALFORMED_SK_LOG_SAMPLE = 10
+
+# Keep-alive connections and adaptive retries, shared by every client in the execution environment
+boto_config = Config(max_pool_connections=64, tcp_keepalive=True, retries={'mode': 'adaptive', 'max_attempts': 5})
 
 # --- Global Clients & Cache ---
 _cached_api_key = None
-table = None
-kinesis_client = None
-secrets_manager_client = None
+dynamodb_client = None
 
 
 # --- Centralized Initialization Block ---
@@ -38,24 +55,22 @@ try:
     # Initialise DynamoDB
     if not DYNAMODB_TABLE_NAME:
         raise EnvironmentError("DYNAMODB_TABLE_NAME environment variable must be set.")
-    dynamodb_resource = boto3.resource('dynamodb', **boto3_kwargs)
-    table = dynamodb_resource.Table(DYNAMODB_TABLE_NAME)
+    # The low-level client is enough for reading key strings and avoids loading the resource layer on cold start
+    dynamodb_client = boto3.client('dynamodb', config=boto_config, **boto3_kwargs)
     logger.info(f"Successfully initialized DynamoDB table client for: {DYNAMODB_TABLE_NAME}")
 
-    # Initialise Kinesis
-    if KINESIS_STREAM_NAME:
-        kinesis_client = boto3.client('kinesis', **boto3_kwargs)
-        logger.info(f"Initialized Kinesis client for stream {KINESIS_STREAM_NAME}")
-
-    # Initialise Secrets Manager
-    if WATCHMODE_API_KEY_SECRET_ARN:
-        secrets_manager_client = boto3.client('secretsmanager', **boto3_kwargs)
-        logger.info("Initialized Secrets Manager client.")
-
 except Exception as e:
     logger.error(f"Error during AWS client initialization: {e}", exc_info=True)
     raise
 
+@lru_cache(maxsize=None)
+def get_client(service_name):
+    """
+    Returns the AWS client for a service, created on first use and reused for the execution environment.
+    Secrets Manager is only needed until the API key is cached, and Kinesis only when there are titles to publish.
+    """
+    return boto3.client(service_name, config=boto_config, **boto3_kwargs)
+
 def get_api_key() -> str:
     """Fetch the WatchMode API key from AWS Secrets Manager, caching it for reuse."""
     global _cached_api_key
@@ -64,11 +79,9 @@ def get_api_key() -> str:
 
     if not WATCHMODE_API_KEY_SECRET_ARN:
         raise ValueError("WATCHMODE_API_KEY_SECRET_ARN environment variable not set.")
-    if not secrets_manager_client:
-        raise RuntimeError("Secrets Manager client was not initialized. Check environment variables.")
 
     try:
-        secret_value_response = secrets_manager_client.get_secret_value(SecretId=WATCHMODE_API_KEY_SECRET_ARN)
+        secret_value_response = get_client('secretsmanager').get_secret_value(SecretId=WATCHMODE_API_KEY_SECRET_ARN)
         _cached_api_key = secret_value_response['SecretString']
         return _cached_api_key
     except ClientError as e:
@@ -77,39 +90,31 @@ def get_api_key() -> str:
 
 
 def get_all_user_preferences() -> dict:
-    """Scan DynamoDB to aggregate all unique source and genre preferences across all users."""
-    all_sources = set()
-    all_genres = set()
+    """Query the EntityTypeIndex to aggregate all unique source and genre preferences across all users."""
     try:
-        # Use the high-level resource's scan method.
-        # It handles pagination automatically when you check for 'LastEvaluatedKey'.
-        response = table.scan(
-            FilterExpression=Key('PK').begins_with(USER_PREF_PREFIX)
-        )
+        # Only user preference items are read, rather than scanning the whole table
+        query_kwargs = {
+            'TableName': DYNAMODB_TABLE_NAME,
+            'IndexName': ENTITY_TYPE_INDEX,
+            'KeyConditionExpression': "entity_type = :entity_type",
+            'ExpressionAttributeValues': {":entity_type": {'S': USER_PREF_ENTITY_TYPE}},
+            'ProjectionExpression': 'SK' # Only the SK carries the preference
+        }
+        response = dynamodb_client.query(**query_kwargs)
         items = response.get('Items', [])
 
-        # Manually handle pagination for subsequent pages if the table is large
+        # Manually handle pagination for subsequent pages if there are many preferences
         while 'LastEvaluatedKey' in response:
-            response = table.scan(
-                FilterExpression=Key('PK').begins_with(USER_PREF_PREFIX),
-                ExclusiveStartKey=response['LastEvaluatedKey']
-            )
+            response = dynamodb_client.query(**query_kwargs, ExclusiveStartKey=response['LastEvaluatedKey'])
             items.extend(response.get('Items', []))
 
-        for item in items:
-            # With the resource API, 'item' is a standard Python dict.
-            # No need to unwrap data types like .get('S').
-            sk = item.get('SK', '')
-            if not sk:
-                continue
-            try:
-                prefix, pref_id = sk.split(':', 1)
-                if prefix == 'source':
-                    all_sources.add(pref_id)
-                elif prefix == 'genre':
-                    all_genres.add(pref_id)
-            except ValueError:
-                logger.warning(f"Skipping malformed SK: {sk}")
+        # Low-level client items keep their type descriptors, e.g. {'SK': {'S': 'source:203'}}
+        sks = [item.get('SK', {}).get('S', '') for item in items]
+        all_sources = {sk[len(SOURCE_PREFIX):] for sk in sks if sk.startswith(SOURCE_PREFIX)}
+        all_genres = {sk[len(GENRE_PREFIX):] for sk in sks if sk.startswith(GENRE_PREFIX)}
+        malformed = [sk for sk in sks if not sk.startswith((SOURCE_PREFIX, GENRE_PREFIX))]
+        if malformed:
+            logger.warning(f"Skipping {len(malformed)} malformed SKs, e.g. {malformed[:MALFORMED_SK_LOG_SAMPLE]}")
 
         logger.info(f"Found {len(all_sources)} unique sources and {len(all_genres)} unique genres.")
         # Sorting the lists makes the output deterministic and easier to test
@@ -125,6 +130,9 @@ def fetch_titles(api_key: str, sources: list, genres: list) -> list:
         logger.info("No sources or genres to fetch titles for.")
         return []
 
+    # Imported on first use so runs with no preferences never load requests
+    import requests
+
     url = f'{WATCHMODE_HOSTNAME}/v1/list-titles/'
     params = {
         "apiKey": api_key,
@@ -143,40 +151,66 @@ def fetch_titles(api_key: str, sources: list, genres: list) -> list:
         logger.error(f"Error fetching titles from WatchMode: {e}")
         return [] # Return empty list on error to not fail the whole process
 
+def put_records_with_retry(chunk: list):
+    """Put a chunk of records to Kinesis, retrying only the records that failed with exponential backoff."""
+    for attempt in range(KINESIS_PUT_MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(0.1 * 2 ** (attempt - 1))
+        response = get_client('kinesis').put_records(StreamName=KINESIS_STREAM_NAME, Records=chunk)
+        if not response.get('FailedRecordCount'):
+            logger.info(f"Successfully published a chunk of {len(chunk)} titles to Kinesis.")
+            return
+        # Result entries line up with the request records; failed ones carry an ErrorCode
+        chunk = [record for record, result in zip(chunk, response['Records']) if result.get('ErrorCode')]
+        logger.warning(f"{len(chunk)} records failed to publish to Kinesis (attempt {attempt + 1}), retrying.")
+
+    raise RuntimeError(f"{len(chunk)} records could not be published to Kinesis after {KINESIS_PUT_MAX_ATTEMPTS} attempts.")
+
 def publish_titles_to_kinesis(titles: list, source_ids: list, genre_ids: list):
     """Publish a list of title records to the Kinesis stream in batches."""
     if not titles:
         logger.info("No titles to publish.")
         return
 
+    # Every record in one ingestion run shares the same header
+    header = {
+        "publishingComponent": "UserPrefsTitleIngestionFunction",
+        "publishTimestamp": datetime.now(timezone.utc).isoformat(),
+        "publishCause": "scheduled_user_prefs_ingestion"
+    }
+
     records = []
+    seen_ids = set()
     for title in titles:
+        # The API can return the same title more than once; publish (and encode) each one only once
+        title_id = title.get('id')
+        if title_id in seen_ids:
+            continue
+        seen_ids.add(title_id)
+
+        # Every title shares the same lists by reference; they are only copied when encoded
         title['source_ids'] = source_ids
         title['genre_ids'] = genre_ids
 
         payload = {
-            "header": {
-                "publishingComponent": "UserPrefsTitleIngestionFunction",
-                "publishTimestamp": datetime.now(timezone.utc).isoformat(),
-                "publishCause": "scheduled_user_prefs_ingestion"
-            },
+            "header": header,
             "payload": title
         }
         records.append({
-            'Data': json.dumps(payload),
+            'Data': record_compressor.compress(orjson.dumps(payload)),
             'PartitionKey': str(title.get('id', 'unknown'))
         })
 
-    # Process records in chunks of 500 (the Kinesis limit)
-    for i in range(0, len(records), 500):
-        chunk = records[i:i + 500]
-        try:
-            if chunk:
-                kinesis_client.put_records(StreamName=KINESIS_STREAM_NAME, Records=chunk)
-                logger.info(f"Successfully published a chunk of {len(chunk)} titles to Kinesis.")
-        except ClientError as e:
-            logger.error(f"Error publishing a chunk of records to Kinesis: {e}")
-            raise
+    get_client('kinesis')  # create the client once, before the worker threads share it
+
+    # Publish chunks of 500 (the Kinesis limit) in parallel; each chunk retries its own failed records
+    chunks = [records[i:i + KINESIS_MAX_RECORDS_PER_PUT] for i in range(0, len(records), KINESIS_MAX_RECORDS_PER_PUT)]
+    try:
+        with ThreadPoolExecutor(max_workers=min(KINESIS_PUT_MAX_WORKERS, len(chunks))) as executor:
+            list(executor.map(put_records_with_retry, chunks))
+    except ClientError as e:
+        logger.error(f"Error publishing a chunk of records to Kinesis: {e}")
+        raise
 
 def lambda_handler(event, context):
     """Orchestrate the title ingestion process based on all user preferences.
@@ -195,7 +229,7 @@ def lambda_handler(event, context):
         else:
             logger.info("No user preferences found, nothing to ingest.")
 
-        return {'statusCode': 200, 'body': json.dumps({'message': 'Ingestion process completed.'})}
+        return {'statusCode': 200, 'body': orjson.dumps({'message': 'Ingestion process completed.'}).decode()}
     except Exception as e:
         logger.error(f"An unhandled error occurred: {e}", exc_info=True)
         raise
\ No newline at end of file
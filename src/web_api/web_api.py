@@ -1,10 +1,14 @@
-import json
 import logging
+import orjson
 import os
+import time
 import boto3
 from datetime import datetime, timedelta
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+from functools import lru_cache
 
 # Configure logger
 logger = logging.getLogger()
@@ -13,26 +17,58 @@ logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
 # --- Environment Variables & Boto3 Clients ---
 DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 AWS_ENDPOINT_URL = os.environ.get('AWS_ENDPOINT_URL')
+# Sources and genres only change on the daily reference refresh, so warm containers reuse them for this long
+REF_DATA_TTL_SECONDS = max(1, int(os.environ.get('REF_DATA_TTL_SECONDS', '300')))
+# Concurrent DynamoDB index queries per request
+QUERY_MAX_WORKERS = int(os.environ.get('QUERY_MAX_WORKERS', '32'))
 
 # Constants
 TITLE_PREFIX = 'title:'
+# Enrichment indexes titles rated above 7 under rec_index:{source_id}:{genre_id}
+REC_INDEX_PREFIX = 'rec_index:'
 USER_PREF_PREFIX = 'userpref:'
 SOURCE_PREFIX = 'source:'
 GENRE_PREFIX = 'genre:'
+# GSI keyed on entity_type (e.g. 'source', 'genre', 'userpref') so entities are queried rather than scanned
+ENTITY_TYPE_INDEX = 'EntityTypeIndex'
+USER_PREF_ENTITY_TYPE = 'userpref'
+# Per-user item where the preferences API keeps a hash of the stored preferences; dropped whenever they change here
+PREFS_SUMMARY_SK = 'summary'
+
+# Keep-alive connections and adaptive retries, shared by the DynamoDB client in the execution environment
+# The pool is sized so every query worker gets its own connection
+boto_config = Config(
+    max_pool_connections=max(64, QUERY_MAX_WORKERS),
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 5}
+)
 
 table = None
+dynamodb_client = None
 try:
     if not DYNAMODB_TABLE_NAME:
         raise EnvironmentError("DYNAMODB_TABLE_NAME environment variable must be set.")
 
     boto3_kwargs = {'endpoint_url': AWS_ENDPOINT_URL} if AWS_ENDPOINT_URL else {}
-    dynamodb_resource = boto3.resource('dynamodb', **boto3_kwargs)
+    dynamodb_resource = boto3.resource('dynamodb', config=boto_config, **boto3_kwargs)
     table = dynamodb_resource.Table(DYNAMODB_TABLE_NAME)
+    # Resources aren't thread-safe, so the pool workers use the resource's client, which is;
+    # it keeps the resource's Python-native (de)serialization
+    dynamodb_client = dynamodb_resource.meta.client
     logger.info(f"Successfully initialized DynamoDB table client for: {DYNAMODB_TABLE_NAME}")
 except Exception as e:
     logger.error(f"Error during AWS client initialization: {e}", exc_info=True)
     raise
 
+# Retries for keys BatchGetItem returns as unprocessed (e.g. when throttled), with exponential backoff
+BATCH_GET_MAX_RETRIES = 5
+# BatchWriteItem accepts at most 25 put/delete requests; unprocessed ones are retried the same way as reads
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_WRITE_MAX_RETRIES = 5
+
+# Shared pool for concurrent DynamoDB reads, reused across warm invocations
+executor = ThreadPoolExecutor(max_workers=QUERY_MAX_WORKERS)
+
 def build_response(status_code, body):
     """Build a standardized API Gateway response."""
     return {
@@ -43,36 +79,52 @@ def build_response(status_code, body):
             'Access-Control-Allow-Headers': 'Content-Type,Authorization',
             'Access-Control-Allow-Methods': 'GET,POST,PUT,DELETE,OPTIONS'
         },
-        'body': json.dumps(body, default=str)
+        'body': orjson.dumps(body, default=str).decode()
+    }
+
+
+def _query_ref_data(prefix: str) -> list:
+    """Query the EntityTypeIndex for all reference data of a type, as id/name pairs."""
+    query_kwargs = {
+        'IndexName': ENTITY_TYPE_INDEX,
+        'KeyConditionExpression': 'entity_type = :entity_type',
+        'ExpressionAttributeValues': {
+            ':entity_type': prefix.rstrip(':')
+        },
+        'ProjectionExpression': 'PK, SK'
     }
+    response = table.query(**query_kwargs)
+    items = response.get('Items', [])
+    while 'LastEvaluatedKey' in response:
+        response = table.query(**query_kwargs, ExclusiveStartKey=response['LastEvaluatedKey'])
+        items.extend(response.get('Items', []))
+
+    ref_data = []
+    for item in items:
+        pk_parts = item.get('PK', '').split(':')
+        if len(pk_parts) == 2:
+            id = pk_parts[1] # Get the ID part after prefix
+            name = item.get('SK', 'Unknown') # Get name from SK
+            ref_data.append({"id": id, "name": name})
+    logger.info(f"Found {len(ref_data)} {prefix} items.")
+    return ref_data
 
+@lru_cache(maxsize=8)
+def _ref_data_response(prefix: str, time_bucket: int) -> dict:
+    """
+    Build the serialized response for a reference data type.
+    Cached per time bucket so warm containers skip both the query and serialization; errors are not cached.
+    """
+    return build_response(200, _query_ref_data(prefix))
 
-def get_ref_data(prefix:str):
-    """Get all sources from DynamoDB."""
+def get_ref_data_response(prefix:str):
+    """Get the API response listing all sources or genres."""
     logger.info(f"Fetching all {prefix}.")
     try:
-        response = table.scan(
-            FilterExpression='begins_with(PK, :prefix)',
-
-            ExpressionAttributeValues={
-                ':prefix': prefix
-            },
-            ProjectionExpression='PK, SK'
-        )
-        
-        ref_data = []
-        for item in response.get('Items', []):
-            pk_parts = item.get('PK', '').split(':')
-            if len(pk_parts) == 2:
-                id = pk_parts[1] # Get the ID part after prefix
-                name = item.get('SK', 'Unknown') # Get name from SK
-                ref_data.append({"id": id, "name": name})
-        
-        logger.info(f"Found {len(ref_data)} sources.")
-        return ref_data
+        return _ref_data_response(prefix, int(time.time()) // REF_DATA_TTL_SECONDS)
     except ClientError as e:
         logger.error(f"DynamoDB error getting ref_data: {e}", exc_info=True)
-        return []
+        return build_response(200, [])
 
 def get_user_preferences(user_id):
     """Get user preferences from DynamoDB."""
@@ -80,20 +132,15 @@ def get_user_preferences(user_id):
         pk = f"{USER_PREF_PREFIX}{user_id}"
         response = table.query(
             KeyConditionExpression='PK = :pk',
-            ExpressionAttributeValues={':pk': pk}
+            ExpressionAttributeValues={':pk': pk},
+            ProjectionExpression='SK' # Only the SK carries the preference
         )
         
-        preferences = {"sources": [], "genres": []}
-        for item in response.get('Items', []):
-            sk = item.get('SK', '')
-            if sk.startswith('source:'):
-                pref_id = sk.split(':', 1)[1]
-                preferences["sources"].append(pref_id)
-            elif sk.startswith('genre:'):
-                pref_id = sk.split(':', 1)[1]
-                preferences["genres"].append(pref_id)
-        
-        return preferences
+        sks = [item.get('SK', '') for item in response.get('Items', [])]
+        return {
+            "sources": [sk[len(SOURCE_PREFIX):] for sk in sks if sk.startswith(SOURCE_PREFIX)],
+            "genres": [sk[len(GENRE_PREFIX):] for sk in sks if sk.startswith(GENRE_PREFIX)]
+        }
     except ClientError as e:
         logger.error(f"DynamoDB error getting preferences for user {user_id}: {e}", exc_info=True)
         return None
@@ -125,28 +172,82 @@ def update_user_preferences(user_id, preferences_data):
             logger.info(f"No preference changes for user {user_id}. Nothing to update.")
             return True
 
-        with table.batch_writer() as batch:
-            # Add new preferences
-            for source_id in sources_to_add:
-                batch.put_item(Item={'PK': f'{USER_PREF_PREFIX}{user_id}', 'SK': f'{SOURCE_PREFIX}{source_id}'})
-            for genre_id in genres_to_add:
-                batch.put_item(Item={'PK': f'{USER_PREF_PREFIX}{user_id}', 'SK': f'{GENRE_PREFIX}{genre_id}'})
-            
-            # Delete old preferences
-            for source_id in sources_to_delete:
-                batch.delete_item(Key={'PK': f'{USER_PREF_PREFIX}{user_id}', 'SK': f'{SOURCE_PREFIX}{source_id}'})
-            for genre_id in genres_to_delete:
-                batch.delete_item(Key={'PK': f'{USER_PREF_PREFIX}{user_id}', 'SK': f'{GENRE_PREFIX}{genre_id}'})
-        
+        pk = f'{USER_PREF_PREFIX}{user_id}'
+        table.delete_item(Key={'PK': pk, 'SK': PREFS_SUMMARY_SK})
+        write_requests = (
+            [{'PutRequest': {'Item': {'PK': pk, 'SK': f'{SOURCE_PREFIX}{source_id}', 'entity_type': USER_PREF_ENTITY_TYPE}}} for source_id in sources_to_add]
+            + [{'PutRequest': {'Item': {'PK': pk, 'SK': f'{GENRE_PREFIX}{genre_id}', 'entity_type': USER_PREF_ENTITY_TYPE}}} for genre_id in genres_to_add]
+            + [{'DeleteRequest': {'Key': {'PK': pk, 'SK': f'{SOURCE_PREFIX}{source_id}'}}} for source_id in sources_to_delete]
+            + [{'DeleteRequest': {'Key': {'PK': pk, 'SK': f'{GENRE_PREFIX}{genre_id}'}}} for genre_id in genres_to_delete]
+        )
+        if not _batch_write(write_requests):
+            logger.error(f"Some preference changes for user {user_id} could not be written.")
+            return False
+
         logger.info(f"Successfully updated preferences for user {user_id}")
         return True
     except ClientError as e:
         logger.error(f"DynamoDB error updating preferences for user {user_id}: {e}", exc_info=True)
         return False
 
-def _get_titles_from_dynamo_optimized(user_id, filter_func=None):
+def _query_index_partition(index_pk):
+    """Return the SK of every item in a source/genre index partition."""
+    query_kwargs = {
+        'TableName': DYNAMODB_TABLE_NAME,
+        'KeyConditionExpression': 'PK = :pk',
+        'ExpressionAttributeValues': {':pk': index_pk},
+        'ProjectionExpression': 'SK' # Only need the title ID
+    }
+    response = dynamodb_client.query(**query_kwargs)
+    items = response.get('Items', [])
+    while 'LastEvaluatedKey' in response:
+        response = dynamodb_client.query(**query_kwargs, ExclusiveStartKey=response['LastEvaluatedKey'])
+        items.extend(response.get('Items', []))
+    return items
+
+def _batch_get_items(keys):
+    """Fetch up to 100 items with BatchGetItem, retrying any unprocessed keys with exponential backoff."""
+    items = []
+    request_items = {
+        DYNAMODB_TABLE_NAME: {
+            'Keys': keys,
+            'ConsistentRead': False # Cheaper and faster
+        }
+    }
+    for attempt in range(BATCH_GET_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(0.05 * 2 ** (attempt - 1))
+        response = dynamodb_client.batch_get_item(RequestItems=request_items)
+        items.extend(response.get('Responses', {}).get(DYNAMODB_TABLE_NAME, []))
+        request_items = response.get('UnprocessedKeys')
+        if not request_items:
+            return items
+    logger.warning(f"Giving up on {len(request_items[DYNAMODB_TABLE_NAME]['Keys'])} unprocessed title keys after {BATCH_GET_MAX_RETRIES} retries.")
+    return items
+
+def _batch_write_chunk(write_requests):
+    """Apply up to 25 put/delete requests with BatchWriteItem, returning any still unprocessed after retries."""
+    request_items = {DYNAMODB_TABLE_NAME: write_requests}
+    for attempt in range(BATCH_WRITE_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(0.05 * 2 ** (attempt - 1))
+        response = dynamodb_client.batch_write_item(RequestItems=request_items)
+        request_items = response.get('UnprocessedItems')
+        if not request_items:
+            return []
+    return request_items[DYNAMODB_TABLE_NAME]
+
+def _batch_write(write_requests):
+    """Apply put/delete requests in concurrent BatchWriteItem chunks, returning True if every request was written."""
+    chunks = [write_requests[i:i + BATCH_WRITE_MAX_ITEMS] for i in range(0, len(write_requests), BATCH_WRITE_MAX_ITEMS)]
+    unprocessed_count = sum(len(unprocessed) for unprocessed in executor.map(_batch_write_chunk, chunks))
+    if unprocessed_count:
+        logger.warning(f"Giving up on {unprocessed_count} unprocessed write requests after {BATCH_WRITE_MAX_RETRIES} retries.")
+    return not unprocessed_count
+
+def _get_titles_from_dynamo_optimized(user_id, recommendations_only=False):
     """
-    Internal helper to get titles based on user preferences, with an optional filter.
+    Internal helper to get titles based on user preferences, optionally only the recommended ones.
     This version is optimized to avoid N+1 queries by using BatchGetItem.
     """
     try:
@@ -155,19 +256,19 @@ def _get_titles_from_dynamo_optimized(user_id, filter_func=None):
             logger.info(f"User {user_id} has no preferences or is missing sources/genres. Returning empty list.")
             return []
 
-        # Step 1: Collect all unique title IDs from the index
+        # Step 1: Collect all unique title IDs from the index, querying every source/genre partition concurrently.
+        # Recommendations read the smaller recommendation index, so unrated titles are never fetched.
+        index_pk_format = f"{REC_INDEX_PREFIX}{{}}:{{}}" if recommendations_only else "source:{}:genre:{}"
+        index_pks = [
+            index_pk_format.format(source_id, genre_id)
+            for source_id in preferences.get('sources', [])
+            for genre_id in preferences.get('genres', [])
+        ]
         title_ids_to_fetch = set()
-        for source_id in preferences.get('sources', []):
-            for genre_id in preferences.get('genres', []):
-                index_pk = f"source:{source_id}:genre:{genre_id}"
-                response = table.query(
-                    KeyConditionExpression='PK = :pk',
-                    ExpressionAttributeValues={':pk': index_pk},
-                    ProjectionExpression='SK' # Only need the title ID
-                )
-                for item in response.get('Items', []):
-                    title_id = item.get('SK', '').split(':', 1)[1]
-                    title_ids_to_fetch.add(title_id)
+        for index_items in executor.map(_query_index_partition, index_pks):
+            for item in index_items:
+                title_id = item.get('SK', '').split(':', 1)[1]
+                title_ids_to_fetch.add(title_id)
         
         if not title_ids_to_fetch:
             logger.warning(f"No title IDs found for user {user_id}'s preferences. This may indicate the ingestion process has not run for the selected source/genre combinations.")
@@ -176,47 +277,38 @@ def _get_titles_from_dynamo_optimized(user_id, filter_func=None):
         # Step 2: Fetch all title records in batches
         keys_to_get = [{'PK': f"{TITLE_PREFIX}{title_id}", 'SK': 'record'} for title_id in title_ids_to_fetch]
         
+        # batch_get_item has a limit of 100 keys per request, so the chunks are fetched concurrently
+        chunks = [keys_to_get[i:i + 100] for i in range(0, len(keys_to_get), 100)]
         all_items = []
-        # batch_get_item has a limit of 100 keys per request. We must chunk the requests.
-        for i in range(0, len(keys_to_get), 100):
-            chunk = keys_to_get[i:i + 100]
-            response = dynamodb_resource.batch_get_item(
-                RequestItems={
-                    DYNAMODB_TABLE_NAME: {
-                        'Keys': chunk,
-                        'ConsistentRead': False # Cheaper and faster
-                    }
-                }
-            )
-            # A production-ready implementation should also handle 'UnprocessedKeys' from the response.
-            all_items.extend(response.get('Responses', {}).get(DYNAMODB_TABLE_NAME, []))
+        for chunk_items in executor.map(_batch_get_items, chunks):
+            all_items.extend(chunk_items)
 
         # Step 3: Process the fetched titles
         titles = []
+        append = titles.append
+        title_prefix_len = len(TITLE_PREFIX)
         for item in all_items:
-            title_data = item.get('data', {})
-            
-            # Apply the filter function if it exists
-            if filter_func and not filter_func(title_data):
-                continue
+            title_data = item.get('data') or {}
 
             # Add a check for essential data. If a title is not enriched with a poster
             # and plot, it's better to not show it than to show an empty card.
-            if not title_data.get('poster') or not title_data.get('plot_overview'):
+            poster = title_data.get('poster')
+            plot_overview = title_data.get('plot_overview')
+            if not poster or not plot_overview:
                 logger.debug(f"Skipping title {item.get('PK')} because it is missing poster or plot.")
                 continue
 
-            title_id = item.get('PK').split(':', 1)[1]
-            titles.append({
-                'id': title_id,
+            user_rating = title_data.get('user_rating')
+            append({
+                'id': item['PK'][title_prefix_len:],
                 'title': title_data.get('title', 'Unknown'),
-                'plot_overview': title_data.get('plot_overview', 'No description available'),
-                'poster': title_data.get('poster', ''),
-                'user_rating': float(title_data.get('user_rating', 0)) if title_data.get('user_rating') else 0,
+                'plot_overview': plot_overview,
+                'poster': poster,
+                'user_rating': float(user_rating) if user_rating else 0,
                 'source_ids': title_data.get('source_ids', []),
                 'genre_ids': title_data.get('genre_ids', [])
             })
-            
+
         return titles
     except ClientError as e:
         logger.error(f"DynamoDB error getting titles for user {user_id}: {e}", exc_info=True)
@@ -228,15 +320,11 @@ def get_titles_by_preferences(user_id):
 
 def get_recommendations(user_id):
     """Get new recommendations for the user (rating > 7)."""
-    def is_recommendation(title_data):
-        user_rating = title_data.get('user_rating', 0)
-        return user_rating and float(user_rating) > 7
-
-    return _get_titles_from_dynamo_optimized(user_id, filter_func=is_recommendation)
+    return _get_titles_from_dynamo_optimized(user_id, recommendations_only=True)
 
 def lambda_handler(event, context):
     """Handle API Gateway requests for the web API."""
-    logger.info(f"Received event: {json.dumps(event)}")
+    logger.info(f"Received event: {orjson.dumps(event).decode()}")
 
     http_method = event.get('httpMethod')
     path = event.get('path')
@@ -248,9 +336,9 @@ def lambda_handler(event, context):
     # --- Public endpoints (no authentication required) ---
     if http_method == 'GET':
         if path == '/sources':
-            return build_response(200, get_ref_data(SOURCE_PREFIX))
+            return get_ref_data_response(SOURCE_PREFIX)
         if path == '/genres':
-            return build_response(200, get_ref_data(GENRE_PREFIX))
+            return get_ref_data_response(GENRE_PREFIX)
 
     # --- Protected endpoints (authentication required) ---
     # For protected endpoints, the user's identity is required to fetch or modify
@@ -280,12 +368,12 @@ def lambda_handler(event, context):
     if http_method == 'PUT':
         if path == '/preferences':
             try:
-                body = json.loads(event.get('body', '{}'))
+                body = orjson.loads(event.get('body', '{}'))
                 if update_user_preferences(user_id, body):
                     return build_response(200, {"message": "Preferences updated successfully"})
                 else:
                     return build_response(500, {"error": "Failed to update preferences"})
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 return build_response(400, {"error": "Invalid JSON in request body"})
 
     return build_response(404, {"error": f"Path not found or method not allowed: {http_method} {path}"})